@@ -0,0 +1,146 @@
+"""
+Offline benchmark suite for ssmx.
+
+Every scenario runs ssmx in a fresh interpreter against benchmarks/ssm_stub.py,
+a local SSM stand-in with configurable per-call latency and throttling, and
+records wall time, API calls per operation, throttled calls and the peak RSS
+of the ssmx process. Results are printed as json lines, one per scenario, so
+runs of different versions can be compared with --compare.
+
+    python benchmarks/run.py [--latency 0.02] [--throttle-rate 0.0] [--max-tps 40] [--quick]
+                             [--only exec-env-file] [--output results.jsonl]
+                             [--compare baseline.jsonl]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from ssm_stub import SSMStub
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RUNNER = 'import ssmx; ssmx.cli(prog_name="ssmx")'
+
+# scenario -> (sizes, quick sizes)
+SIZES = {
+    'exec-env-file': ((1, 10, 100, 500), (1, 10, 100)),
+    'exec-name': ((10, 100, 1000, 10000), (10, 100, 1000)),
+    'list': ((1000, 10000, 100000), (1000, 10000)),
+    'get-bulk': ((10, 100, 1000), (10, 100)),
+    'put-bulk': ((10, 100, 1000), (10, 100)),
+    'delete-bulk': ((10, 100, 1000), (10, 100)),
+}
+
+
+def setup(scenario, size, stub, workdir):
+    """setup seeds <stub> for a scenario and returns the ssmx arguments to run."""
+    names = ['/bench/app/key%05d' % i for i in range(size)]
+    if scenario == 'exec-env-file':
+        stub.seed(names)
+        env_file = os.path.join(workdir, 'bench.env')
+        with open(env_file, 'w') as f:
+            for i, name in enumerate(names):
+                f.write('KEY_%d=ssm:%s\n' % (i, name))
+        return ['exec', '--env-file', env_file, '--', 'true']
+    if scenario == 'exec-name':
+        stub.seed(names)
+        return ['exec', '--name', '/bench/app', '--', 'true']
+    if scenario == 'list':
+        stub.seed(names)
+        return ['list', '--output', 'jsonl']
+    if scenario == 'get-bulk':
+        stub.seed(names)
+        names_file = os.path.join(workdir, 'names.txt')
+        with open(names_file, 'w') as f:
+            f.write('\n'.join(names))
+        return ['get', '--names-from', names_file]
+    if scenario == 'put-bulk':
+        # Half the entries exist already and half of those are unchanged
+        stub.seed(names[:size // 2], param_type='String')
+        entries = [dict(name=name, value='value-%s' % name if i % 4 else 'changed') for i, name in enumerate(names)]
+        params_file = os.path.join(workdir, 'params.json')
+        with open(params_file, 'w') as f:
+            json.dump(entries, f)
+        return ['put', '--from-file', params_file]
+    if scenario == 'delete-bulk':
+        stub.seed(names)
+        return ['delete', '--prefix', '/bench/app/']
+    raise ValueError(scenario)
+
+
+def run_scenario(scenario, size, latency, throttle_rate, max_tps=None):
+    stub = SSMStub(latency=latency, throttle_rate=throttle_rate).start()
+    workdir = tempfile.mkdtemp(prefix='ssmx-bench-')
+    try:
+        args = setup(scenario, size, stub, workdir)
+        env = dict(os.environ, PYTHONPATH=ROOT, AWS_ENDPOINT_URL_SSM=stub.endpoint,
+                   AWS_ACCESS_KEY_ID='bench', AWS_SECRET_ACCESS_KEY='bench', AWS_DEFAULT_REGION='us-east-1')
+        env.pop('AWS_PROFILE', None)
+        if max_tps:
+            args = ['--max-tps', str(max_tps)] + args
+        started = time.time()
+        proc = subprocess.Popen([sys.executable, '-c', RUNNER] + args, env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        stderr = proc.stderr.read()
+        _, status, rusage = os.wait4(proc.pid, 0)
+        wall = time.time() - started
+        proc.returncode = os.waitstatus_to_exitcode(status) if hasattr(os, 'waitstatus_to_exitcode') else status
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        peak_rss_kb = rusage.ru_maxrss // 1024 if sys.platform == 'darwin' else rusage.ru_maxrss
+        return dict(scenario=scenario, size=size, latency_s=latency, throttle_rate=throttle_rate, max_tps=max_tps,
+                    wall_s=round(wall, 4), api_calls=dict(sorted(stub.calls.items())),
+                    total_api_calls=sum(stub.calls.values()), throttled=stub.throttled,
+                    peak_rss_kb=peak_rss_kb, exit_code=proc.returncode,
+                    error=stderr.decode('utf-8', 'replace')[-500:] if proc.returncode else None)
+    finally:
+        stub.stop()
+
+
+def compare(results, baseline_path):
+    """compare prints the wall time and api call changes against a previous run."""
+    with open(baseline_path) as f:
+        baseline = dict(((row['scenario'], row['size']), row) for row in (json.loads(line) for line in f if line.strip()))
+    for row in results:
+        before = baseline.get((row['scenario'], row['size']))
+        if not before:
+            continue
+        ratio = row['wall_s'] / before['wall_s'] if before['wall_s'] else float('inf')
+        sys.stderr.write('%-14s %6d  wall %7.3fs -> %7.3fs (x%.2f)  calls %5d -> %5d  rss %6d -> %6d kB\n' % (
+            row['scenario'], row['size'], before['wall_s'], row['wall_s'], ratio, before['total_api_calls'],
+            row['total_api_calls'], before['peak_rss_kb'], row['peak_rss_kb']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds added to every SSM call')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='probability that a call is throttled')
+    parser.add_argument('--max-tps', type=float, help='ssmx --max-tps, its default when omitted')
+    parser.add_argument('--quick', action='store_true', help='skip the largest sizes')
+    parser.add_argument('--only', action='append', choices=sorted(SIZES), help='scenarios to run (repeatable)')
+    parser.add_argument('--output', help='also append the json lines to this file')
+    parser.add_argument('--compare', metavar='BASELINE', help='json lines of a previous run to compare with')
+    args = parser.parse_args()
+
+    results = []
+    for scenario in args.only or sorted(SIZES):
+        sizes, quick_sizes = SIZES[scenario]
+        for size in quick_sizes if args.quick else sizes:
+            result = run_scenario(scenario, size, args.latency, args.throttle_rate, args.max_tps)
+            results.append(result)
+            line = json.dumps(result, sort_keys=True)
+            print(line)
+            sys.stdout.flush()
+            if args.output:
+                with open(args.output, 'a') as f:
+                    f.write(line + '\n')
+    if args.compare:
+        compare(results, args.compare)
+    sys.exit(1 if any(result['exit_code'] for result in results) else 0)
+
+
+if __name__ == '__main__':
+    main()
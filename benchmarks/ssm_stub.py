@@ -0,0 +1,218 @@
+"""
+A small, local stand-in for the SSM JSON API, for benchmarks.
+
+It implements the operations ssmx uses (GetParameter, GetParameters,
+GetParametersByPath, DescribeParameters, PutParameter, DeleteParameter and
+DeleteParameters) against an in-memory store. Every call can be given a fixed
+latency and a probability of being throttled, and calls are counted per
+operation. Point ssmx at it with AWS_ENDPOINT_URL_SSM.
+
+    stub = SSMStub(latency=0.02, throttle_rate=0.05)
+    stub.seed('/app/key%d' % i for i in range(1000))
+    stub.start()
+    ...
+    stub.stop()
+"""
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Page size limits of the real API
+MAX_BY_PATH_RESULTS = 10
+MAX_DESCRIBE_RESULTS = 50
+
+
+class SSMError(Exception):
+
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.code = code
+
+
+class SSMStub(object):
+
+    def __init__(self, latency=0.0, throttle_rate=0.0, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.params = {}
+        self.views = {}
+        self.calls = {}
+        self.throttled = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def endpoint(self):
+        host, port = self.server.server_address[:2]
+        return 'http://%s:%d' % (host, port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_counts(self):
+        with self.lock:
+            self.calls = {}
+            self.throttled = 0
+
+    def seed(self, names, value='value', param_type='SecureString'):
+        """seed stores a parameter for each of <names>, without going through HTTP."""
+        with self.lock:
+            for name in names:
+                self.store(dict(Name=name, Value='%s-%s' % (value, name), Type=param_type))
+
+    def view(self, key, select):
+        """
+        view returns the sorted names matching <select>, cached under <key>
+        until the store changes, so paging through a large result stays cheap.
+        """
+        if key not in self.views:
+            self.views[key] = [name for name in sorted(self.params) if select(self.params[name])]
+        return self.views[key]
+
+    def store(self, request):
+        self.views = {}
+        current = self.params.get(request['Name'])
+        self.params[request['Name']] = dict(
+            Name=request['Name'], Value=request['Value'], Type=request.get('Type', 'String'),
+            Description=request.get('Description', ''), Version=current['Version'] + 1 if current else 1,
+            LastModifiedDate=time.time(), Tier='Standard', DataType='text')
+        return self.params[request['Name']]
+
+    def handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Headers and body go out in separate writes; don't let Nagle delay the body
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                operation = self.headers.get('X-Amz-Target', '').split('.')[-1]
+                status, payload = stub.dispatch(operation, json.loads(body or b'{}'))
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/x-amz-json-1.1')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def dispatch(self, operation, request):
+        with self.lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.throttle_rate and random.random() < self.throttle_rate:
+            with self.lock:
+                self.throttled += 1
+            return 400, {'__type': 'ThrottlingException', 'message': 'Rate exceeded'}
+        method = getattr(self, 'op_%s' % operation, None)
+        if method is None:
+            return 400, {'__type': 'InvalidAction', 'message': 'Unsupported operation %s' % operation}
+        try:
+            with self.lock:
+                return 200, method(request)
+        except SSMError as e:
+            return 400, {'__type': e.code, 'message': str(e)}
+
+    def lookup(self, selector):
+        """lookup returns the parameter for a name, ignoring :version/:label selectors."""
+        name = selector.split(':')[0] if not selector.startswith('arn:') else selector
+        return self.params.get(name)
+
+    def op_GetParameter(self, request):
+        param = self.lookup(request['Name'])
+        if param is None:
+            raise SSMError('ParameterNotFound', request['Name'])
+        return {'Parameter': param}
+
+    def op_GetParameters(self, request):
+        if len(request['Names']) > 10:
+            raise SSMError('ValidationException', 'Names holds more than 10 names')
+        found = [self.lookup(name) for name in request['Names']]
+        return {'Parameters': [param for param in found if param],
+                'InvalidParameters': [name for name, param in zip(request['Names'], found) if not param]}
+
+    def op_GetParametersByPath(self, request):
+        path = request['Path'].rstrip('/') + '/'
+        recursive = request.get('Recursive', False)
+        names = self.view(('by-path', path, recursive), lambda param: param['Name'].startswith(path) and (
+            recursive or '/' not in param['Name'][len(path):]))
+        return self.page(names, request, MAX_BY_PATH_RESULTS)
+
+    def op_DescribeParameters(self, request):
+        key = json.dumps([request.get('Filters'), request.get('ParameterFilters')], sort_keys=True)
+        names = self.view(('describe', key), lambda param: self.matches(param, request))
+        response = self.page(names, request, MAX_DESCRIBE_RESULTS)
+        response['Parameters'] = [dict((k, v) for k, v in param.items() if k != 'Value')
+                                  for param in response['Parameters']]
+        return response
+
+    def op_PutParameter(self, request):
+        if request['Name'] in self.params and not request.get('Overwrite'):
+            raise SSMError('ParameterAlreadyExists', request['Name'])
+        param = self.store(request)
+        return {'Version': param['Version'], 'Tier': 'Standard'}
+
+    def op_DeleteParameter(self, request):
+        self.views = {}
+        if self.params.pop(request['Name'], None) is None:
+            raise SSMError('ParameterNotFound', request['Name'])
+        return {}
+
+    def op_DeleteParameters(self, request):
+        self.views = {}
+        deleted = [name for name in request['Names'] if self.params.pop(name, None) is not None]
+        return {'DeletedParameters': deleted,
+                'InvalidParameters': [name for name in request['Names'] if name not in deleted]}
+
+    def page(self, names, request, max_results):
+        size = min(request.get('MaxResults', max_results), max_results)
+        start = int(request.get('NextToken') or 0)
+        response = {'Parameters': [self.params[name] for name in names[start:start + size]]}
+        if start + size < len(names):
+            response['NextToken'] = str(start + size)
+        return response
+
+    def matches(self, param, request):
+        for legacy in request.get('Filters', []):
+            if legacy['Key'] == 'Name' and not any(param['Name'].startswith(v) for v in legacy['Values']):
+                return False
+        for parameter_filter in request.get('ParameterFilters', []):
+            key = parameter_filter['Key']
+            option = parameter_filter.get('Option', 'Equals')
+            values = parameter_filter.get('Values', [])
+            if key == 'Path':
+                path = values[0].rstrip('/') + '/'
+                rest = param['Name'][len(path):]
+                if not param['Name'].startswith(path) or (option == 'OneLevel' and '/' in rest):
+                    return False
+            elif key == 'Name':
+                if option == 'BeginsWith':
+                    if not any(param['Name'].startswith(v) for v in values):
+                        return False
+                elif option == 'Contains':
+                    if not any(v in param['Name'] for v in values):
+                        return False
+                elif param['Name'] not in values:
+                    return False
+            elif key in ('Type', 'Tier', 'DataType'):
+                if param.get(key) not in values:
+                    return False
+        return True
@@ -0,0 +1,103 @@
+"""
+Startup benchmark for the ssmx entry point.
+
+Runs the commands that should start fast (`--help`, `--version` and an `exec`
+with a plain env file) in fresh interpreters and reports their wall time, the
+cumulative `-X importtime` cost of `import ssmx` and any heavy module that got
+imported along the way. Exits with 1 when a heavy module shows up, so it can
+guard against import regressions in CI.
+
+    python benchmarks/startup.py [--runs 10] [--json]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules only the commands talking to AWS or printing tables may import
+HEAVY_MODULES = ['boto3', 'botocore', 'tabulate', 'concurrent.futures', 'cryptography']
+
+RUNNER = '''
+import json, sys
+import ssmx
+try:
+    ssmx.cli(sys.argv[1:], prog_name='ssmx')
+except SystemExit:
+    pass
+sys.stdout.flush()
+sys.stderr.write(json.dumps(sorted(set(%r) & set(sys.modules))) + "\\n")
+''' % (HEAVY_MODULES,)
+
+
+def run(args):
+    """run executes ssmx with <args> in a fresh interpreter and returns (seconds, heavy modules)."""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    start = time.time()
+    proc = subprocess.run([sys.executable, '-c', RUNNER] + args, env=env,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    elapsed = time.time() - start
+    return elapsed, json.loads(proc.stderr.strip().splitlines()[-1])
+
+
+def import_time():
+    """import_time returns the cumulative -X importtime cost of `import ssmx`, in seconds."""
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ssmx'], env=env,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+    for line in proc.stderr.splitlines():
+        fields = [field.strip() for field in line.split('|')]
+        if len(fields) == 3 and fields[2] == 'ssmx':
+            return int(fields[1]) / 1e6
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10, help='runs per command')
+    parser.add_argument('--json', action='store_true', help='print results as json')
+    args = parser.parse_args()
+
+    env_file = tempfile.NamedTemporaryFile('w', suffix='.env', delete=False)
+    env_file.write('PLAIN_ENV_VAR=hello world\n')
+    env_file.close()
+    commands = {
+        'help': ['--help'],
+        'version': ['--version'],
+        'exec-plain-env-file': ['exec', '--env-file', env_file.name, '--', 'true'],
+    }
+
+    results = {'import_ssmx_s': import_time(), 'commands': {}}
+    failed = False
+    for label, command in sorted(commands.items()):
+        timings = []
+        heavy = []
+        for _ in range(args.runs):
+            elapsed, heavy = run(command)
+            timings.append(elapsed)
+        timings.sort()
+        results['commands'][label] = {
+            'min_s': timings[0],
+            'median_s': timings[len(timings) // 2],
+            'heavy_modules': heavy,
+        }
+        failed = failed or bool(heavy)
+    os.unlink(env_file.name)
+
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        print('import ssmx: %.1f ms' % (results['import_ssmx_s'] * 1000))
+        for label, result in sorted(results['commands'].items()):
+            print('%-22s min %6.1f ms  median %6.1f ms  heavy modules: %s' % (
+                label, result['min_s'] * 1000, result['median_s'] * 1000,
+                ', '.join(result['heavy_modules']) or 'none'))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -13,15 +13,20 @@ setup(
     long_description=long_description,
     long_description_content_type="text/markdown",
     version='v1.0.3',
-    py_modules=['ssmx'],
+    packages=['ssmx'],
     download_url="https://github.com/JetJet13/ssmx/archive/v1.0.2.tar.gz",
     include_package_data=True,
     install_requires=[
         'click',
         'boto3',
         'tabulate',
-        'subprocess32'
+        'subprocess32',
+        'futures; python_version < "3"'
     ],
+    extras_require={
+        'cache': ['cryptography'],
+        'yaml': ['PyYAML']
+    },
     entry_points='''
         [console_scripts]
         ssmx=ssmx:cli
@@ -0,0 +1,2669 @@
+import click
+import contextlib
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from os import environ
+
+IMPORT_STARTED = time.time()
+
+# boto3, botocore, tabulate, subprocess32, concurrent.futures and hashlib are imported
+# by the functions that need them: `ssmx --help` or an exec without ssm: refs
+# should not pay for loading them. benchmarks/startup.py tracks this.
+
+# Upper bound on concurrent SSM requests per client; the connection pool is
+# sized to match so concurrent callers never wait on a free connection.
+MAX_POOL_CONNECTIONS = 32
+
+# GetParameters and DeleteParameters accept at most 10 names per call
+MAX_NAMES_PER_CALL = 10
+# A DescribeParameters ParameterFilters value list holds at most 50 names
+MAX_NAMES_PER_FILTER = 50
+# Number of batches in flight at once for the concurrent helpers
+MAX_WORKERS = 8
+# GetParametersByPath returns at most 10 parameters per page
+MAX_BY_PATH_RESULTS = 10
+# Writes have a far lower TPS allowance than reads, so fewer are kept in flight
+MAX_WRITE_WORKERS = 4
+
+OUTPUT_FORMATS = ['table', 'json', 'jsonl', 'tsv']
+# Columns list can print, from the parameters' metadata
+LIST_FIELDS = ['Name', 'Description', 'Type', 'Version', 'LastModifiedDate', 'LastModifiedUser', 'Tier',
+               'KeyId', 'DataType', 'ARN', 'AllowedPattern']
+PARAMETER_TYPES = ['String', 'StringList', 'SecureString']
+PARAMETER_TIERS = ['Standard', 'Advanced', 'Intelligent-Tiering']
+# --profile and --region value standing for every configured profile or enabled region
+ALL_ENABLED = 'all-enabled'
+# Seconds exec waits on a region before falling back to the next one
+DEFAULT_FALLBACK_TIMEOUT = 5.0
+# Signals exec passes on to the command it supervises
+FORWARDED_SIGNALS = ('SIGTERM', 'SIGINT', 'SIGHUP')
+# Seconds a command gets to exit after SIGTERM before exec --watch kills it
+RESTART_TIMEOUT = 10
+# Shortest exec --watch interval, and largest jitter, so polls never come back to back
+MIN_WATCH_INTERVAL = 0.1
+MAX_WATCH_JITTER = 0.9
+
+# Default request rate shared by every SSM call in the process
+DEFAULT_MAX_TPS = 40.0
+# Lowest rate the limiter backs off to while SSM keeps throttling
+MIN_TPS = 1.0
+# Retries allowed across the whole process before failures are surfaced as is
+DEFAULT_RETRY_BUDGET = 50
+MAX_ATTEMPTS_PER_CALL = 8
+RETRY_BASE_DELAY = 0.1
+RETRY_MAX_DELAY = 5.0
+THROTTLING_ERRORS = ('ThrottlingException', 'Throttling', 'TooManyUpdates', 'RequestLimitExceeded')
+# Upper bounds, in milliseconds, of the latency histogram buckets reported by --timings
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# Seconds load_env serves a memoized environment before resolving it again
+DEFAULT_ENV_TTL = 300
+# Seconds list --local trusts the metadata index before syncing it again
+DEFAULT_INDEX_TTL = 900
+# Most names offered by shell completion
+MAX_COMPLETIONS = 200
+# Seconds the ssmx agent serves a parameter before fetching it again
+DEFAULT_AGENT_TTL = 60
+# Seconds a process waits to connect to the ssmx agent, then for its answer, before calling SSM itself
+AGENT_CONNECT_TIMEOUT = 0.5
+AGENT_TIMEOUT = 5
+# Bytes of version-pinned parameters kept on disk before the least recently used are evicted
+DEFAULT_PINNED_CACHE_BYTES = 16 * 1024 * 1024
+
+_clients = {}
+_clients_lock = threading.Lock()
+_env_memo = {}
+_env_memo_lock = threading.Lock()
+# id(client) -> time of the client's last SSM response, for resolve_with_fallback
+_last_response = {}
+# ids of the clients resolve_with_fallback gave up on; call() refuses them
+_abandoned = set()
+
+
+class SSMXError(click.ClickException):
+    """
+    SSMXError is raised by the ssmx helpers when parameters can't be read or
+    written. Commands let it propagate: click prints its message on stderr
+    and exits with 1.
+    """
+
+    def show(self, file=None):
+        click.echo(self.format_message(), file=file, err=True)
+
+
+@click.group()
+@click.version_option()
+@click.option('--max-tps', metavar='<tps>', type=click.FloatRange(min=MIN_TPS), envvar='SSMX_MAX_TPS',
+              default=DEFAULT_MAX_TPS, show_default=True, help='Upper bound on SSM requests per second')
+@click.option('--retry-budget', metavar='<retries>', type=click.IntRange(min=0), envvar='SSMX_RETRY_BUDGET',
+              default=DEFAULT_RETRY_BUDGET, show_default=True,
+              help='Retries of throttled or failed SSM calls allowed per run')
+@click.option('--timings', is_flag=True, default=False,
+              help='Print SSM call counts, latencies and phase timings on stderr')
+@click.option('--metrics-json', metavar='<file>', required=False,
+              help='Write SSM call and phase metrics as json to <file>, or to a descriptor with fd:<n>')
+@click.pass_context
+def cli(ctx, max_tps, retry_budget, timings, metrics_json):
+    """
+    ssmx is a CLI tool for injecting parameters stored in AWS SSM into executables.
+    It also provides commands to retrieve and set parameters in AWS SSM.
+    """
+    rate_limiter.configure(max_tps, retry_budget)
+    ctx.call_on_close(rate_limiter.report)
+    if timings or metrics_json:
+        metrics.enable(timings, metrics_json)
+        ctx.call_on_close(metrics.emit)
+
+
+def get_client(profile, region):
+    """
+    get_client returns the process-wide ssm client for (profile, region),
+    creating it on first use. boto3 clients are thread-safe, so a single
+    client and its connection pool are shared by every helper and worker.
+    """
+    key = (profile, region)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            with metrics.phase('client_setup'):
+                import boto3
+                from botocore.config import Config
+                config = Config(
+                    max_pool_connections=MAX_POOL_CONNECTIONS,
+                    connect_timeout=3,
+                    read_timeout=10,
+                    tcp_keepalive=True,
+                    # Retries go through call() so the rate limiter sees every attempt
+                    retries={'total_max_attempts': 1, 'mode': 'standard'},
+                )
+                session = boto3.Session(profile_name=profile, region_name=region)
+                client = session.client('ssm', config=config)
+            if metrics.enabled:
+                # Resolve credentials up front so the first call's latency doesn't include them
+                with metrics.phase('credentials'):
+                    session.get_credentials()
+                metrics.instrument(client)
+            _clients[key] = client
+    return client
+
+
+def clear_clients():
+    """clear_clients drops every cached client, i.e. after credentials change."""
+    with _clients_lock:
+        _clients.clear()
+        # Client ids may be reused once the clients are gone
+        _last_response.clear()
+        _abandoned.clear()
+
+
+class RateLimiter(object):
+    """
+    RateLimiter is a token bucket shared by every SSM call in the process.
+    Its rate halves whenever SSM throttles and climbs back towards <max_tps>
+    as calls succeed. It also holds the process-wide retry budget and counts
+    throttled and retried calls.
+    """
+
+    def __init__(self, max_tps, retry_budget):
+        self.lock = threading.Lock()
+        self.configure(max_tps, retry_budget)
+
+    def configure(self, max_tps, retry_budget):
+        with self.lock:
+            self.max_tps = max_tps
+            self.rate = max_tps
+            self.tokens = max(1.0, max_tps)
+            self.updated = time.time()
+            self.retry_budget = retry_budget
+            self.calls = 0
+            self.throttled = 0
+            self.retried = 0
+            self.reported = False
+
+    def acquire(self):
+        """acquire blocks until a call may be sent."""
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(max(1.0, self.max_tps), self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.calls += 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_tps, self.rate + 1)
+
+    def on_throttle(self):
+        with self.lock:
+            self.throttled += 1
+            self.rate = max(MIN_TPS, self.rate / 2)
+
+    def take_retry(self):
+        """take_retry spends one retry from the budget, returning False once it is exhausted."""
+        with self.lock:
+            if self.retry_budget <= 0:
+                return False
+            self.retry_budget -= 1
+            self.retried += 1
+            return True
+
+    def report(self):
+        """report prints the throttle and retry counts on stderr, once, if there were any."""
+        if (self.throttled or self.retried) and not self.reported:
+            self.reported = True
+            click.echo("%d SSM calls, %d throttled, %d retried" % (self.calls, self.throttled, self.retried),
+                       err=True)
+
+
+rate_limiter = RateLimiter(DEFAULT_MAX_TPS, DEFAULT_RETRY_BUDGET)
+
+
+class Metrics(object):
+    """
+    Metrics records, when enabled, per-operation SSM call counts, latencies,
+    errors, retries, throttles, pages and response bytes via botocore's
+    event hooks, along with the time spent in each phase of a command.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.enabled = False
+        self.timings = False
+        self.json_target = None
+        self.emitted = False
+        self.operations = {}
+        self.phases = {}
+
+    def enable(self, timings, json_target):
+        self.enabled = True
+        self.timings = timings
+        self.json_target = json_target
+        self.phases['import'] = IMPORT_DURATION
+
+    def operation(self, name):
+        if name not in self.operations:
+            self.operations[name] = dict(calls=0, errors=0, retries=0, throttles=0, pages=0,
+                                         response_bytes=0, latencies=[])
+        return self.operations[name]
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """phase adds the time spent in the with block to the phase <name>."""
+        started = time.time()
+        try:
+            yield
+        finally:
+            if self.enabled:
+                with self.lock:
+                    self.phases[name] = self.phases.get(name, 0.0) + time.time() - started
+
+    def count(self, client, operation, field):
+        """count bumps <field> for the client method <operation>, keyed by its API name."""
+        if self.enabled:
+            name = client.meta.method_to_api_mapping.get(operation, operation)
+            with self.lock:
+                self.operation(name)[field] += 1
+
+    def instrument(self, client):
+        """instrument hooks the call events of <client>."""
+        client.meta.events.register('before-call.ssm', self.before_call)
+        client.meta.events.register('after-call.ssm', self.after_call)
+        client.meta.events.register('after-call-error.ssm', self.after_call_error)
+
+    def before_call(self, context, **kwargs):
+        context['ssmx_started'] = time.time()
+
+    def after_call(self, http_response, model, context, **kwargs):
+        with self.lock:
+            stats = self.operation(model.name)
+            stats['calls'] += 1
+            stats['latencies'].append(time.time() - context.get('ssmx_started', time.time()))
+            stats['response_bytes'] += len(http_response.content or b'')
+            if http_response.status_code >= 400:
+                stats['errors'] += 1
+
+    def after_call_error(self, context, event_name, **kwargs):
+        # The event carries no operation model, only its name: after-call-error.ssm.<Operation>
+        with self.lock:
+            stats = self.operation(event_name.split('.')[-1])
+            stats['calls'] += 1
+            stats['errors'] += 1
+            stats['latencies'].append(time.time() - context.get('ssmx_started', time.time()))
+
+    def summary(self):
+        """summary returns the metrics as a json-friendly dict, latencies reduced to a histogram."""
+        with self.lock:
+            operations = {}
+            for name, stats in sorted(self.operations.items()):
+                latencies = sorted(stats['latencies'])
+                summary = dict((field, value) for field, value in stats.items() if field != 'latencies')
+                summary['latency_ms'] = latency_summary(latencies)
+                operations[name] = summary
+            return dict(operations=operations, phases_s=dict(self.phases),
+                        total_s=time.time() - IMPORT_STARTED)
+
+    def emit(self):
+        """emit writes the summary to stderr and/or the json target, once."""
+        if not self.enabled or self.emitted:
+            return
+        self.emitted = True
+        summary = self.summary()
+        if self.json_target:
+            document = json.dumps(summary, sort_keys=True)
+            if self.json_target.startswith('fd:'):
+                f = os.fdopen(int(self.json_target[3:]), 'w')
+                f.write(document + '\n')
+                f.flush()
+            else:
+                with open(self.json_target, 'w') as f:
+                    f.write(document + '\n')
+        if self.timings:
+            for name, seconds in sorted(summary['phases_s'].items()):
+                click.echo("phase %-12s %8.1f ms" % (name, seconds * 1000), err=True)
+            for name, stats in sorted(summary['operations'].items()):
+                latency = stats['latency_ms']
+                click.echo("%-22s %4d calls %3d errors %3d retries %3d throttles %4d pages %8d bytes  "
+                           "p50 %.1f ms  p99 %.1f ms  max %.1f ms" % (
+                               name, stats['calls'], stats['errors'], stats['retries'], stats['throttles'],
+                               stats['pages'], stats['response_bytes'], latency['p50'], latency['p99'],
+                               latency['max']), err=True)
+            click.echo("total %.1f ms" % (summary['total_s'] * 1000), err=True)
+
+
+def latency_summary(latencies):
+    """latency_summary reduces sorted latencies, in seconds, to percentiles and a histogram in ms."""
+    ms = [latency * 1000 for latency in latencies]
+
+    def percentile(p):
+        return ms[min(len(ms) - 1, int(len(ms) * p))] if ms else 0.0
+
+    histogram = dict(('<=%d' % bound, 0) for bound in LATENCY_BUCKETS_MS)
+    histogram['>%d' % LATENCY_BUCKETS_MS[-1]] = 0
+    for value in ms:
+        for bound in LATENCY_BUCKETS_MS:
+            if value <= bound:
+                histogram['<=%d' % bound] += 1
+                break
+        else:
+            histogram['>%d' % LATENCY_BUCKETS_MS[-1]] += 1
+    return dict(p50=percentile(0.5), p90=percentile(0.9), p99=percentile(0.99),
+                max=ms[-1] if ms else 0.0, histogram=histogram)
+
+
+metrics = Metrics()
+
+
+def is_throttle(error):
+    code = getattr(error, 'response', {}).get('Error', {}).get('Code')
+    return code in THROTTLING_ERRORS
+
+
+def is_transient(error):
+    """is_transient tells whether <error> is a connection failure or a 5xx worth retrying."""
+    from botocore.exceptions import ConnectionError, HTTPClientError
+    if isinstance(error, (ConnectionError, HTTPClientError)):
+        return True
+    status = getattr(error, 'response', {}).get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+    return status >= 500
+
+
+def call(client, operation, **kwargs):
+    """
+    call runs the SSM <operation> through the shared rate limiter. Throttled
+    and transient failures are retried with decorrelated jitter while the
+    retry budget lasts; anything else is raised to the caller. Clients
+    abandoned by resolve_with_fallback make no more calls.
+    """
+    delay = RETRY_BASE_DELAY
+    attempt = 1
+    while True:
+        if id(client) in _abandoned:
+            raise SSMXError("Abandoned for a fallback region")
+        rate_limiter.acquire()
+        try:
+            response = getattr(client, operation)(**kwargs)
+        except Exception as e:
+            throttled = is_throttle(e)
+            if throttled:
+                rate_limiter.on_throttle()
+                metrics.count(client, operation, 'throttles')
+            if not (throttled or is_transient(e)) or attempt >= MAX_ATTEMPTS_PER_CALL \
+                    or not rate_limiter.take_retry():
+                raise
+            metrics.count(client, operation, 'retries')
+            attempt += 1
+            delay = min(RETRY_MAX_DELAY, random.uniform(RETRY_BASE_DELAY, delay * 3))
+            time.sleep(delay)
+            continue
+        rate_limiter.on_success()
+        _last_response[id(client)] = time.time()
+        return response
+
+
+def paginate(client, operation, **kwargs):
+    """paginate lazily yields the pages of <operation>, fetching each one through call()."""
+    while True:
+        page = call(client, operation, **kwargs)
+        metrics.count(client, operation, 'pages')
+        yield page
+        if not page.get('NextToken'):
+            return
+        kwargs['NextToken'] = page['NextToken']
+
+
+def thread_pool(max_workers):
+    """thread_pool returns a ThreadPoolExecutor, importing concurrent.futures on first use."""
+    from concurrent.futures import ThreadPoolExecutor
+    return ThreadPoolExecutor(max_workers=max_workers)
+
+
+def tabulate(*args, **kwargs):
+    """tabulate defers importing the tabulate package until a table is printed."""
+    from tabulate import tabulate as tabulate_
+    return tabulate_(*args, **kwargs)
+
+
+def chunks(items, size):
+    """chunks lazily splits <items> into consecutive lists of at most <size> items."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def unique(items):
+    """unique lazily drops repeated items while keeping the order they were given in."""
+    seen = set()
+    for item in items:
+        if item not in seen:
+            seen.add(item)
+            yield item
+
+
+def completion(func):
+    """completion hooks <func> into shell completion of an option, on click versions that have it (8+)."""
+    return dict(shell_complete=func) if hasattr(click.Parameter, 'shell_complete') else {}
+
+
+def completion_index(ctx):
+    """completion_index returns the metadata index of the command's first profile and region, if there is one."""
+    def first(value):
+        return value[0] if isinstance(value, tuple) and value else value or None
+    index = ParamIndex(first(ctx.params.get('profile')), first(ctx.params.get('region')))
+    return index if index.exists() else None
+
+
+def complete_names(ctx, param, incomplete):
+    """complete_names completes parameter names from the local metadata index, without calling AWS."""
+    index = completion_index(ctx)
+    if index is None:
+        return []
+    try:
+        return [row['Name'] for row in index.query(names=[incomplete], limit=MAX_COMPLETIONS)]
+    except Exception:
+        return []
+
+
+def complete_paths(ctx, param, incomplete):
+    """complete_paths completes parameter paths one level at a time from the local metadata index."""
+    index = completion_index(ctx)
+    if index is None:
+        return []
+    try:
+        names = [row['Name'] for row in index.query(names=[incomplete])]
+    except Exception:
+        return []
+    paths = []
+    for name in names:
+        end = name.find('/', len(incomplete) + 1)
+        paths.append(name[:end + 1] if end > 0 else name)
+    return [path for path in unique(paths)][:MAX_COMPLETIONS]
+
+
+def enabled_regions(profile):
+    """enabled_regions returns the regions enabled for the account of <profile>."""
+    import boto3
+    session = boto3.Session(profile_name=profile)
+    client = session.client('ec2', region_name=session.region_name or 'us-east-1')
+    try:
+        response = call(client, 'describe_regions')
+    except Exception as e:
+        raise SSMXError("Error listing regions: %s" % e)
+    return sorted(region['RegionName'] for region in response['Regions'])
+
+
+def expand_targets(profiles, regions):
+    """
+    expand_targets returns the (profile, region) targets of a command, each
+    of <profiles> with each of <regions>, in the order given. all-enabled
+    stands for every configured profile, or every region enabled for the
+    account. No profile or region means the default one.
+    """
+    profiles = [profile for profile in profiles] or [None]
+    if ALL_ENABLED in profiles:
+        import boto3
+        profiles = boto3.Session().available_profiles
+    targets = []
+    for profile in profiles:
+        profile_regions = [region for region in regions] or [None]
+        if ALL_ENABLED in profile_regions:
+            profile_regions = enabled_regions(profile)
+        for region in profile_regions:
+            targets.append((profile, region))
+    return [target for target in unique(targets)]
+
+
+def target_label(profile, region):
+    """target_label names a (profile, region) target in fan-out output, i.e. default/us-east-1."""
+    return '%s/%s' % (profile or 'default', region or get_client(profile, region).meta.region_name)
+
+
+def fan_out(targets, func):
+    """
+    fan_out runs func(profile, region) for every target concurrently, each
+    target on its own pooled client.
+
+    Returns the label, result and error of every target, in the order given.
+    A target that fails has a None result and its error, so one denied or
+    unreachable target never hides the others (see report_failed_targets).
+    """
+    def run(target):
+        label = target_label(*target)
+        try:
+            return label, func(*target), None
+        except Exception as e:
+            return label, None, str(e)
+
+    with thread_pool(min(MAX_WORKERS, len(targets))) as executor:
+        return [result for result in executor.map(run, targets)]
+
+
+def report_failed_targets(results):
+    """
+    report_failed_targets prints the targets of fan_out <results> that
+    failed, with their errors, on stderr and raises SSMXError if there were
+    any, once the other targets have been reported.
+    """
+    failed = [(label, error) for label, _, error in results if error is not None]
+    if failed:
+        click.echo(tabulate({'Target': [label for label, _ in failed], 'Error': [error for _, error in failed]},
+                            headers='keys', tablefmt='grid'), err=True)
+        raise SSMXError("Error: %d of %d targets failed" % (len(failed), len(results)))
+
+
+def diff_rows(rows, labels, fields):
+    """
+    diff_rows keeps the <rows> of the names whose <fields> differ between
+    the targets <labels>, or which some targets lack. Missing rows are
+    filled in with <missing>.
+    """
+    by_name = {}
+    for row in rows:
+        by_name.setdefault(row['Name'], {})[row['Target']] = row
+    output = []
+    for name in sorted(by_name):
+        found = by_name[name]
+        values = set(json.dumps([row.get(field) for field in fields], default=str) for row in found.values())
+        if len(values) < 2 and len(found) == len(labels):
+            continue
+        for label in labels:
+            missing = dict((field, '<missing>') for field in fields)
+            missing.update(Target=label, Name=name)
+            output.append(found.get(label, missing))
+    return output
+
+
+def list_query(names=(), path=None, recursive=False, types=(), tiers=(), key_id=None, labels=(), contains=()):
+    """
+    list_query maps the filters of list onto ParameterFilters, so SSM only
+    returns the matching parameters, 50 per page.
+
+    describe_parameters can't filter by label, so with <labels> parameters
+    are found with get_parameters_by_path under <path> (recursively under /
+    by default), which can't filter by name or tier.
+
+    Returns the operation and its arguments.
+    """
+    filters = []
+    if types:
+        filters.append({'Key': 'Type', 'Option': 'Equals', 'Values': [t for t in types]})
+    if key_id:
+        filters.append({'Key': 'KeyId', 'Option': 'Equals', 'Values': [key_id]})
+    if labels:
+        filters.append({'Key': 'Label', 'Option': 'Equals', 'Values': [label for label in labels]})
+        return 'get_parameters_by_path', dict(Path=path or '/', Recursive=recursive or not path,
+                                              ParameterFilters=filters, MaxResults=10)
+    if names:
+        filters.append({'Key': 'Name', 'Option': 'BeginsWith', 'Values': [name for name in names]})
+    elif contains:
+        filters.append({'Key': 'Name', 'Option': 'Contains', 'Values': [text for text in contains]})
+    if path:
+        filters.append({'Key': 'Path', 'Option': 'Recursive' if recursive else 'OneLevel', 'Values': [path]})
+    if tiers:
+        filters.append({'Key': 'Tier', 'Option': 'Equals', 'Values': [tier for tier in tiers]})
+    return 'describe_parameters', dict(ParameterFilters=filters, MaxResults=50)
+
+
+def list_params(names, profile, region, limit=None, path=None, recursive=False, types=(), tiers=(),
+                key_id=None, labels=(), fields=('Name', 'Description'), contains=()):
+    """
+    list_params lazily yields the <fields> of the parameters starting with
+    any of <names> and matching the filters of list_query, one page at a
+    time. Paging stops as soon as <limit> parameters have been yielded.
+    """
+    if limit is not None and limit <= 0:
+        return
+    client = get_client(profile, region)
+    operation, kwargs = list_query(names, path, recursive, types, tiers, key_id, labels, contains)
+    count = 0
+    try:
+        for page in paginate(client, operation, **kwargs):
+            for param in page['Parameters']:
+                yield dict((field, param.get(field, '')) for field in fields)
+                count += 1
+                if limit is not None and count >= limit:
+                    return
+    except Exception as e:
+        raise SSMXError("Error listing parameters: %s" % e)
+
+
+def tsv_field(value):
+    """tsv_field escapes the characters that would break a tsv row."""
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+
+def echo_rows(rows, fields, output):
+    """
+    echo_rows prints <rows> with the columns <fields> in the <output> format.
+    Every format except table prints each row as soon as it arrives.
+
+    Returns the number of rows printed.
+    """
+    count = 0
+    if output == 'table':
+        rows = [row for row in rows]
+        if rows:
+            click.echo(tabulate(dict((field, [row.get(field, '') for row in rows]) for field in fields),
+                                headers='keys', tablefmt='grid'))
+        return len(rows)
+    if output == 'json':
+        click.echo('[', nl=False)
+    elif output == 'tsv':
+        click.echo('\t'.join(fields))
+    for row in rows:
+        values = [(field, row.get(field, '')) for field in fields]
+        if output == 'tsv':
+            click.echo('\t'.join(tsv_field(value) for _, value in values))
+        else:
+            line = json.dumps(dict(values), default=str, sort_keys=True)
+            if output == 'json':
+                line = ('\n  ' if count == 0 else ',\n  ') + line
+                click.echo(line, nl=False)
+            else:
+                click.echo(line)
+        count += 1
+    if output == 'json':
+        click.echo('\n]' if count else ']')
+    return count
+
+@cli.command(name="list")
+@click.option('--name', '-n', '--begins-with', metavar='<name>', multiple=True,
+              help='Show parameters starting with <name>', **completion(complete_names))
+@click.option('--contains', metavar='<text>', multiple=True, help='Show parameters whose name contains <text>')
+@click.option('--path', metavar='<path>', required=False, help='Show parameters directly under <path>')
+@click.option('--recursive', is_flag=True, default=False, help='With --path, also show parameters in sub-paths')
+@click.option('--type', 'types', type=click.Choice(PARAMETER_TYPES), multiple=True, help='Show parameters of this type')
+@click.option('--tier', 'tiers', type=click.Choice(PARAMETER_TIERS), multiple=True, help='Show parameters of this tier')
+@click.option('--key-id', metavar='<key_id>', required=False, help='Show parameters encrypted with this KMS key')
+@click.option('--label', 'labels', metavar='<label>', multiple=True,
+              help='Show parameters with <label>; can\'t be combined with --name or --tier')
+@click.option('--fields', metavar='<fields>', default='Name,Description', show_default=True,
+              help='Comma separated columns: %s' % ', '.join(LIST_FIELDS))
+@click.option('--output', '-o', type=click.Choice(OUTPUT_FORMATS), default='table',
+              help='Output format; every format except table is printed as pages arrive')
+@click.option('--limit', metavar='<count>', type=int, required=False, help='Stop after <count> parameters')
+@click.option('--diff', is_flag=True, default=False,
+              help='Only show parameters whose fields differ between profiles/regions')
+@click.option('--local', is_flag=True, default=False,
+              help='Answer from the local metadata index, syncing it when older than %d seconds' % DEFAULT_INDEX_TTL)
+@click.option('--refresh', is_flag=True, default=False, help='Sync the local metadata index first; implies --local')
+@click.option('--profile', '-p', metavar='<profile>', multiple=True,
+              help='an aws profile. Repeatable, or all-enabled for every configured profile')
+@click.option('--region', '-r', metavar='<region>', multiple=True,
+              help='aws Region, i.e. us-east-1. Repeatable, or all-enabled for every enabled region')
+def list(name, contains, path, recursive, types, tiers, key_id, labels, fields, output, limit, diff, local, refresh,
+         profile, region):
+    """List available parameters, filtered by SSM."""
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in LIST_FIELDS]
+    if unknown or not fields:
+        raise click.BadParameter('unknown fields %s; choose from %s' % (', '.join(unknown), ', '.join(LIST_FIELDS)),
+                                 param_hint="'--fields'")
+    local = local or refresh
+    if labels and (name or tiers or contains or local):
+        raise click.UsageError("--label can't be combined with --name, --begins-with, --contains, --tier or --local.")
+    if name and contains and not local:
+        raise click.UsageError("--contains can only be combined with --name with --local.")
+    if path and not path.startswith('/'):
+        path = '/' + path
+    targets = expand_targets(profile, region)
+    if diff and len(targets) < 2:
+        raise click.UsageError("--diff needs more than one --profile or --region.")
+
+    def rows_for(profile, region):
+        if local:
+            index = ParamIndex(profile, region)
+            if refresh or not index.is_fresh(DEFAULT_INDEX_TTL):
+                index.sync()
+            rows = index.query(names=name, contains=contains, path=path, recursive=recursive, types=types,
+                               tiers=tiers, key_id=key_id, limit=limit)
+            return (dict((field, row.get(field, '')) for field in fields) for row in rows)
+        return list_params(name, profile, region, limit=limit, path=path, recursive=recursive, types=types,
+                           tiers=tiers, key_id=key_id, labels=labels, fields=fields, contains=contains)
+
+    if len(targets) == 1:
+        count = echo_rows(rows_for(*targets[0]), fields, output)
+    else:
+        # Every target is listed concurrently; rows are labelled with their target
+        results = fan_out(targets, lambda profile, region: [row for row in rows_for(profile, region)])
+        rows = []
+        for label, target_rows, error in results:
+            for row in target_rows or []:
+                row['Target'] = label
+                rows.append(row)
+        if diff:
+            # Failed targets can't be compared; they are reported below instead
+            labels = [label for label, _, error in results if error is None]
+            rows = diff_rows(rows, labels, [f for f in fields if f != 'Name'])
+        count = echo_rows(rows, ['Target'] + fields, output)
+    if not count and output == 'table':
+        click.echo("No parameters found.")
+    if len(targets) > 1:
+        report_failed_targets(results)
+
+
+
+
+
+def find_param_names(path, prefix, profile, region):
+    """
+    find_param_names lazily yields the names of parameters under <path>
+    (recursively) and of parameters whose name starts with <prefix>.
+    Only metadata is paged through, values are never fetched.
+    """
+    client = get_client(profile, region)
+    filters = []
+    if path:
+        filters.append([{'Key': 'Path', 'Option': 'Recursive', 'Values': [path]}])
+    if prefix:
+        filters.append([{'Key': 'Name', 'Option': 'BeginsWith', 'Values': [prefix]}])
+    for parameter_filters in filters:
+        try:
+            for page in paginate(client, 'describe_parameters', ParameterFilters=parameter_filters,
+                                 MaxResults=50):
+                for param in page['Parameters']:
+                    yield param['Name']
+        except Exception as e:
+            raise SSMXError("Error listing parameters: %s" % e)
+
+
+def delete_params(names, profile, region):
+    """
+    delete_params deletes <names> in batches of 10. Batches are submitted as
+    soon as they fill up, and a small pool keeps deletes under the write
+    throttling limits.
+
+    Returns the deleted names and the invalid names. A failed batch doesn't
+    stop the others; once every batch has finished the error is raised with
+    the names that were deleted alongside it.
+    """
+    client = get_client(profile, region)
+
+    def delete_batch(batch):
+        return call(client, 'delete_parameters', Names=batch)
+
+    deleted = []
+    invalid = []
+    errors = []
+    with thread_pool(MAX_WRITE_WORKERS) as executor:
+        futures = [executor.submit(delete_batch, batch)
+                   for batch in chunks(unique(names), MAX_NAMES_PER_CALL)]
+        for future in futures:
+            try:
+                response = future.result()
+            except Exception as e:
+                errors.append(str(e))
+                continue
+            deleted.extend(response.get('DeletedParameters', []))
+            invalid.extend(response.get('InvalidParameters', []))
+    if errors:
+        report = []
+        if deleted:
+            report.append(tabulate({'Deleted Parameters': deleted}, headers='keys', tablefmt='grid'))
+        if invalid:
+            report.append(tabulate({'Invalid Parameters': invalid}, headers='keys', tablefmt='grid'))
+        report.append("Error deleting parameters: %s" % '; '.join(unique(errors)))
+        raise SSMXError('\n'.join(report))
+    return deleted, invalid
+
+@cli.command(name="delete")
+@click.option('--name', '-n', metavar='<name>', multiple=True, required=False, help='Name of the parameter to delete',
+              **completion(complete_names))
+@click.option('--path', metavar='<path>', required=False, help='delete every parameter under <path>, recursively')
+@click.option('--prefix', metavar='<prefix>', required=False, help='delete every parameter whose name starts with <prefix>')
+@click.option('--dry-run', is_flag=True, default=False, help='Print the parameters that would be deleted and exit')
+@click.option('--profile', '-p', metavar='<profile>', required=False, help='an aws profile')
+@click.option('--region', '-r', metavar='<region>', required=False, help='aws Region, i.e. us-east-1')
+def delete(name, path, prefix, dry_run, profile, region):
+    """Delete parameters with <name>, under <path> or starting with <prefix>."""
+    if not (name or path or prefix):
+        raise click.UsageError("Missing option '--name', '--path' or '--prefix'.")
+    if path and not path.startswith('/'):
+        path = '/' + path
+    # Enumerate everything before deleting so paging isn't disturbed by the deletes
+    names = [n for n in unique(itertools.chain(name, find_param_names(path, prefix, profile, region)))]
+    if dry_run:
+        if names:
+            click.echo(tabulate({'Parameters To Delete': names}, headers='keys', tablefmt='grid'))
+        else:
+            click.echo("No parameters found.")
+        return
+    output, err = delete_params(names, profile, region)
+    # Print if specified otherwise return output
+    if output:
+        click.echo(tabulate({'Deleted Parameters': output}, headers='keys', tablefmt='grid'))
+    if err:
+        click.echo(tabulate({'Invalid Parameters': err}, headers='keys', tablefmt='grid'))
+    if not (output or err):
+        click.echo("No parameters found.")
+
+
+
+
+
+
+def split_selector(name):
+    """
+    split_selector splits <name> into the parameter name and its version or
+    label selector (name:3, name:prod), which is None when there is none.
+    Parameter names can't hold colons, so only the part after the last / is
+    looked at; ARNs hold theirs before it.
+    """
+    if ':' not in name.rsplit('/', 1)[-1]:
+        return name, None
+    name, selector = name.rsplit(':', 1)
+    return name, selector
+
+
+def pinned_version(name):
+    """pinned_version returns the version <name> selects (3 for name:3), or None."""
+    selector = split_selector(name)[1]
+    return int(selector) if selector and selector.isdigit() else None
+
+
+def name_batches(names):
+    """
+    name_batches splits <names> into GetParameters batches of at most 10 in
+    which no parameter is requested twice (i.e. name:1 and name:prod), so
+    every parameter returned answers exactly one of the batch's names.
+    """
+    rounds = []
+    requested = {}
+    for name in names:
+        base = split_selector(name)[0]
+        index = requested.get(base, 0)
+        requested[base] = index + 1
+        if index == len(rounds):
+            rounds.append([])
+        rounds[index].append(name)
+    return [batch for names in rounds for batch in chunks(names, MAX_NAMES_PER_CALL)]
+
+
+def selected_name(param, batch):
+    """
+    selected_name returns which name of <batch> (see name_batches) <param>
+    answers. A name requested with a selector comes back without it; SSM
+    returns the Selector, which is filled in when missing.
+    Returns <param>'s Name when it answers none of them (i.e. an ARN).
+    """
+    if param.get('Selector'):
+        return param['Name'] + param['Selector']
+    for name in batch:
+        base, selector = split_selector(name)
+        if base == param['Name']:
+            if selector is not None:
+                param['Selector'] = ':' + selector
+            return name
+    return param['Name']
+
+
+def display_name(param):
+    """display_name returns the Name of <param> with the selector it was requested with."""
+    return param['Name'] + (param.get('Selector') or '')
+
+
+def request_params(client, names):
+    """
+    request_params runs GetParameters for <names> in batches of 10, with the
+    batches running concurrently. Names may carry a version or label
+    selector. Errors are raised to the caller.
+
+    Returns a dict of name -> parameter, keyed as requested, and a list of
+    invalid names.
+    """
+    def fetch(batch):
+        return call(client, 'get_parameters', Names=batch, WithDecryption=True)
+
+    params = {}
+    invalid = []
+    batches = name_batches(names)
+    with thread_pool(MAX_WORKERS) as executor:
+        for batch, response in zip(batches, executor.map(fetch, batches)):
+            for param in response.get('Parameters', []):
+                params[selected_name(param, batch)] = param
+            invalid.extend(response.get('InvalidParameters', []))
+    return params, invalid
+
+
+def request_metadata(client, parameter_filters):
+    """
+    request_metadata returns name -> describe_parameters record for the
+    parameters matching <parameter_filters>. Nothing is decrypted.
+    """
+    metadata = {}
+    for page in paginate(client, 'describe_parameters', ParameterFilters=parameter_filters, MaxResults=50):
+        for param in page['Parameters']:
+            metadata[param['Name']] = param
+    return metadata
+
+
+def request_versions(client, parameter_filters):
+    """request_versions returns name -> Version for the parameters matching <parameter_filters>."""
+    metadata = request_metadata(client, parameter_filters)
+    return dict((name, param['Version']) for name, param in metadata.items())
+
+
+def request_metadata_by_name(client, names):
+    """
+    request_metadata_by_name returns name -> describe_parameters record for
+    the existing parameters among <names>, filtering on as many names per
+    call as SSM allows.
+    """
+    metadata = {}
+    for batch in chunks(names, MAX_NAMES_PER_FILTER):
+        metadata.update(request_metadata(client, [{'Key': 'Name', 'Option': 'Equals', 'Values': batch}]))
+    return metadata
+
+
+def request_versions_by_name(client, names):
+    """request_versions_by_name returns name -> Version for the existing parameters among <names>."""
+    metadata = request_metadata_by_name(client, names)
+    return dict((name, param['Version']) for name, param in metadata.items())
+
+
+def fetch_params(names, profile, region, cache=None, pinned=False):
+    """
+    fetch_params resolves <names> with GetParameters in batches of 10 and runs
+    the batches concurrently. Duplicate names are only fetched once.
+
+    With <pinned> (or $SSMX_PINNED_CACHE=1), names pinned to a version
+    (name:3) are served from the PinnedCache, and only fetched the first
+    time. With a <cache>, fresh entries are used as is
+    and expired entries are revalidated by Version; if SSM can't be reached,
+    expired entries are served instead of failing. When an ssmx agent is
+    listening, it answers instead and <cache> is unused.
+
+    Returns a dict of name -> parameter and a list of invalid names.
+    """
+    names = [name for name in unique(names)]
+    exact = [name for name in names if pinned_version(name) is not None]
+    store = pinned_cache(profile, region, enabled=pinned) if exact else None
+    params = {}
+    if store:
+        for name in exact:
+            param = store.load(name)
+            if param is not None:
+                params[name] = param
+    missing = [name for name in names if name not in params]
+    if not missing:
+        return params, []
+
+    response = agent_request(dict(op='names', names=missing, profile=profile, region=region))
+    if response is not None:
+        fetched, invalid = response['params'], response['invalid']
+    else:
+        fetched, invalid = request_cached(missing, profile, region, cache=cache)
+    if store:
+        store.store(dict((name, fetched[name]) for name in exact if name in fetched))
+    params.update(fetched)
+    return params, invalid
+
+
+def request_cached(names, profile, region, cache=None):
+    """
+    request_cached fetches <names> from SSM for fetch_params, going through
+    <cache> when one is given.
+    """
+    client = get_client(profile, region)
+    params = {}
+    stale = {}
+    if cache:
+        for name in names:
+            entry = cache.load('name', name)
+            if entry is None:
+                continue
+            if cache.is_fresh(entry):
+                params[name] = entry['params'][0]
+            else:
+                stale[name] = entry['params'][0]
+
+    try:
+        if stale:
+            versions = request_versions_by_name(client, stale)
+            for name, param in stale.items():
+                if versions.get(name) == param['Version']:
+                    params[name] = param
+                    cache.store('name', name, [param])
+        missing = [name for name in names if name not in params]
+        fetched, invalid = request_params(client, missing)
+    except Exception as e:
+        missing = [name for name in names if name not in params]
+        if stale and all(name in stale for name in missing):
+            click.echo("Heads Up! Unable to reach SSM (%s); using cached values." % e, err=True)
+            params.update(stale)
+            return params, []
+        raise SSMXError("Error getting parameters: %s" % e)
+
+    if cache:
+        for name, param in fetched.items():
+            cache.store('name', name, [cache_record(param)])
+    params.update(fetched)
+    return params, invalid
+
+
+def get_params(names, profile, region):
+    """
+    get_params retrieves <names> in concurrent batches of 10 and returns the
+    parameters and invalid names in the order the names were given.
+    """
+    names = [name for name in unique(names)]
+    params, invalid = fetch_params(names, profile, region)
+    output = [params.pop(name) for name in names if name in params]
+    # Names SSM reports under a different form (i.e. ARNs) go last
+    output.extend(params.values())
+    invalid = set(invalid)
+    err = [name for name in names if name in invalid]
+    return output, err
+
+
+def read_names(names_file):
+    """read_names returns the parameter names listed one per line in <names_file>."""
+    names = []
+    for line in names_file:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            names.append(line)
+    return names
+
+@cli.command(name="get")
+@click.option('--name', '-n', metavar='<name>', multiple=True, required=False,
+              help='Name of the parameter to retrieve, or name:version / name:label for a given version',
+              **completion(complete_names))
+@click.option('--names-from', metavar='<file>', type=click.File('r'), required=False,
+              help='file listing parameter names one per line, or - for stdin')
+@click.option('--diff', is_flag=True, default=False,
+              help='Only show parameters whose values differ between profiles/regions')
+@click.option('--profile', '-p', metavar='<profile>', multiple=True,
+              help='an aws profile. Repeatable, or all-enabled for every configured profile')
+@click.option('--region', '-r', metavar='<region>', multiple=True,
+              help='aws Region, i.e. us-east-1. Repeatable, or all-enabled for every enabled region')
+def get(name, names_from, diff, profile, region, print_output=True):
+    """Retrieve values of parameters with <name>."""
+    names = [n for n in name]
+    if names_from:
+        names.extend(read_names(names_from))
+    if not names:
+        raise click.UsageError("Missing option '--name' or '--names-from'.")
+    targets = expand_targets(profile, region)
+    if diff and len(targets) < 2:
+        raise click.UsageError("--diff needs more than one --profile or --region.")
+    if len(targets) > 1:
+        results = fan_out(targets, lambda profile, region: get_params(names, profile, region))
+        fetched = [(label, result) for label, result, error in results if error is None]
+        rows = [dict(Target=label, Name=display_name(param), Value=param['Value'])
+                for label, (output, _) in fetched for param in output]
+        if diff:
+            rows = diff_rows(rows, [label for label, _ in fetched], ['Value'])
+        if rows:
+            click.echo(tabulate(dict((field, [row[field] for row in rows]) for field in ('Target', 'Name', 'Value')),
+                                headers='keys', tablefmt='grid'))
+        elif diff:
+            click.echo("No differences found.")
+        invalid = [(label, param) for label, (_, err) in fetched for param in err]
+        if invalid and not diff:
+            click.echo(tabulate({'Target': [label for label, _ in invalid],
+                                 'Invalid Parameters': [param for _, param in invalid]},
+                                headers='keys', tablefmt='grid'))
+        report_failed_targets(results)
+        return
+    output, err = get_params(names, *targets[0])
+    if output:
+        click.echo(tabulate({'Name': [display_name(param) for param in output],
+                             'Value': [param['Value']for param in output]},
+                            headers='keys', tablefmt='grid'))
+    if err:
+        click.echo(tabulate({'Invalid Parameters': [param for param in err]},
+                            headers='keys', tablefmt='grid'))
+
+
+
+
+
+
+
+def put_param(name, value, encrypt, key_id, profile, region, description):
+    client = get_client(profile, region)
+    if encrypt:
+        if key_id is None:
+            raise SSMXError("Heads Up! I'm unable to encrypt without specifying a KMS Key ID; Retry with --key-id <KMS_KEY_ID>")
+        param_type = 'SecureString'
+    else:
+        if key_id:
+            raise SSMXError("Heads Up! --key-id is required only when --encrypt is specified.")
+        param_type = 'String'
+    try:
+        if key_id:
+            call(client, 'put_parameter', Name=name, Value=value, Description=description,
+                 Overwrite=True, Type=param_type, KeyId=key_id)
+        else:
+            call(client, 'put_parameter', Name=name, Value=value, Overwrite=True, Description=description,
+                 Type=param_type)
+    except Exception as e:
+        raise SSMXError("Error putting parameters: %s" % e)
+    # return the name of the variable in case of success
+    return name
+
+def load_yaml(f):
+    """load_yaml parses a YAML document, PyYAML being an optional dependency."""
+    try:
+        import yaml
+    except ImportError:
+        raise SSMXError("Heads Up! Reading YAML files requires PyYAML; install it with pip install ssmx[yaml]")
+    return yaml.safe_load(f)
+
+
+def load_entries(path):
+    """
+    load_entries reads the parameters to put from a .json, .yaml/.yml or .env
+    file. JSON and YAML files hold either a {name: value} mapping or a list of
+    entries with name, value and optional description, type, encrypt and key_id.
+
+    Returns a list of dicts with Name, Value, Type, Description and KeyId.
+    Type is None when the entry doesn't ask for one (see inherit_types), and
+    Description when it gives none, so the current one is kept.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.json', '.yaml', '.yml'):
+        with open(path, 'r') as f:
+            data = json.load(f) if extension == '.json' else load_yaml(f)
+    else:
+        data = parse_env_file(path)
+    if isinstance(data, dict):
+        data = [dict(name=name, value=value) for name, value in sorted(data.items())]
+
+    entries = []
+    for item in data:
+        if not isinstance(item, dict):
+            item = dict(name=item[0], value=item[1])
+        param_type = item.get('type') or ('SecureString' if item.get('encrypt') else None)
+        entries.append(dict(Name=item['name'], Value=entry_value(item['name'], item['value']), Type=param_type,
+                            Description=item.get('description'), KeyId=item.get('key_id')))
+    return entries
+
+
+def entry_value(name, value):
+    """
+    entry_value returns the string stored for the file value <value> of
+    <name>. Booleans are written the way JSON and YAML spell them; null,
+    lists and mappings have no single string form and are rejected.
+    """
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    # type([]) as list is the list command in this module
+    if value is None or isinstance(value, (dict, tuple, type([]))):
+        raise SSMXError("Error reading %s: values must be strings, numbers or booleans, got %s"
+                        % (name, json.dumps(value)))
+    return str(value)
+
+
+def inherit_types(entries, remote, metadata=None):
+    """
+    inherit_types gives the <entries> without a Type the Type of the <remote>
+    parameter (name -> parameter) they replace, or String for new ones, so
+    rewriting a secret never stores it as plaintext. Inherited SecureStrings
+    also keep their KeyId from <metadata> (name -> describe record).
+    """
+    typed = []
+    for entry in entries:
+        param = remote.get(entry['Name'])
+        if entry['Type'] is None:
+            entry = dict(entry, Type=param['Type'] if param else 'String')
+            if param and param['Type'] == 'SecureString' and not entry['KeyId'] and metadata:
+                entry['KeyId'] = metadata.get(entry['Name'], {}).get('KeyId')
+        typed.append(entry)
+    return typed
+
+
+def write_params(client, entries):
+    """write_params puts <entries> concurrently on the write pool. Errors are raised."""
+    def write(entry):
+        kwargs = dict(Name=entry['Name'], Value=entry['Value'], Type=entry['Type'], Overwrite=True)
+        # Without a Description SSM keeps the current one
+        if entry['Description'] is not None:
+            kwargs['Description'] = entry['Description']
+        if entry['KeyId']:
+            kwargs['KeyId'] = entry['KeyId']
+        return call(client, 'put_parameter', **kwargs)
+
+    with thread_pool(MAX_WRITE_WORKERS) as executor:
+        for _ in executor.map(write, entries):
+            pass
+
+
+def put_params(entries, profile, region):
+    """
+    put_params upserts <entries> (as returned by load_entries), writing only
+    the entries whose value, type, description or key changed. Entries
+    without a type or description keep the current one. Current values are read in batches
+    and the writes run concurrently.
+
+    Returns the created, updated and unchanged names.
+    """
+    client = get_client(profile, region)
+    names = [entry['Name'] for entry in entries]
+    try:
+        current, _ = request_params(client, names)
+        metadata = request_metadata_by_name(client, current)
+    except Exception as e:
+        raise SSMXError("Error getting parameters: %s" % e)
+
+    created = []
+    updated = []
+    unchanged = []
+    writes = []
+    for entry in inherit_types(entries, current, metadata):
+        param = current.get(entry['Name'])
+        if param is None:
+            created.append(entry['Name'])
+        elif (param['Value'] != entry['Value'] or param['Type'] != entry['Type']
+                or (entry['Description'] is not None
+                    and metadata.get(entry['Name'], {}).get('Description', '') != entry['Description'])
+                or (entry['KeyId'] and metadata.get(entry['Name'], {}).get('KeyId') != entry['KeyId'])):
+            updated.append(entry['Name'])
+        else:
+            unchanged.append(entry['Name'])
+            continue
+        writes.append(entry)
+
+    try:
+        write_params(client, writes)
+    except Exception as e:
+        raise SSMXError("Error putting parameters: %s" % e)
+    return created, updated, unchanged
+
+@cli.command(name="put", help='Upsert parameters')
+@click.option('--name', '-n', metavar='<name>', required=False, help='Name of the parameter')
+@click.option('--value', '-v', metavar='<value>', required=False, help='Value of the parameter')
+@click.option('--from-file', metavar='<file>', required=False, type=click.Path(exists=True, dir_okay=False),
+              help='.json, .yaml or .env file of parameters to upsert; only changed entries are written')
+@click.option('--description', '-d', metavar='<description>', default="", help='Description for the parameter')
+@click.option('--encrypt', '-e', is_flag=True, default=False, help='Encrypt the parameter')
+@click.option('--key-id', '-k', metavar='<key_id>', required=False, help='KMS Key ID to encrypt. Required option if --encrypt is used.')
+@click.option('--profile', '-p', metavar='<profile>', required=False, help='an aws profile')
+@click.option('--region', '-r', metavar='<region>', required=False, help='aws Region, i.e. us-east-1')
+def put(name, value, from_file, encrypt, description, key_id, profile, region):
+    """Put parameter with name <name>, value <value> and description <description>. Optionally encrypt the parameter."""
+    if from_file:
+        if name or value:
+            raise click.UsageError("--from-file can't be combined with --name or --value.")
+        entries = load_entries(from_file)
+        if encrypt:
+            for entry in entries:
+                entry['Type'] = entry['Type'] or 'SecureString'
+                entry['KeyId'] = entry['KeyId'] or key_id
+        created, updated, unchanged = put_params(entries, profile, region)
+        for title, names in (('Created Parameters', created), ('Updated Parameters', updated),
+                             ('Unchanged Parameters', unchanged)):
+            if names:
+                click.echo(tabulate({title: names}, headers='keys', tablefmt='grid'))
+        return
+    if name is None or value is None:
+        raise click.UsageError("Missing option '--name' and '--value', or '--from-file'.")
+    output = put_param(name=name, value=value, description=description, encrypt=encrypt, key_id=key_id, profile=profile, region=region)
+    if output:
+        click.echo(tabulate({'Created Parameters': [output]}, headers='keys', tablefmt='grid'))
+
+
+
+
+
+
+def load_tree(source, path, encrypt):
+    """
+    load_tree reads the local side of a sync. In a directory, every file is a
+    parameter named after its path relative to <source>, holding the file's
+    content. Files are read with load_entries. Relative names are placed under
+    <path>. With <encrypt> every entry is a SecureString; otherwise entries
+    that don't give a type have none (see inherit_types).
+    """
+    if os.path.isdir(source):
+        entries = []
+        for root, dirs, files in os.walk(source):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+            for filename in sorted(files):
+                if filename.startswith('.'):
+                    continue
+                with open(os.path.join(root, filename), 'r') as f:
+                    value = f.read().rstrip('\n')
+                name = os.path.relpath(os.path.join(root, filename), source).replace(os.sep, '/')
+                entries.append(dict(Name=name, Value=value, Type='SecureString' if encrypt else None,
+                                    Description=None, KeyId=None))
+    else:
+        entries = load_entries(source)
+        if encrypt:
+            for entry in entries:
+                entry['Type'] = 'SecureString'
+    for entry in entries:
+        if not entry['Name'].startswith('/'):
+            entry['Name'] = path.rstrip('/') + '/' + entry['Name']
+    return entries
+
+
+def diff_tree(entries, remote, prune):
+    """
+    diff_tree compares local <entries> with the <remote> parameters (name ->
+    parameter) by value and type.
+
+    Returns the entries to create, the entries to update and the names to
+    delete; nothing is deleted unless <prune> is set.
+    """
+    local_names = set()
+    create = []
+    update = []
+    for entry in entries:
+        local_names.add(entry['Name'])
+        param = remote.get(entry['Name'])
+        if param is None:
+            create.append(entry)
+        elif param['Value'] != entry['Value'] or param['Type'] != entry['Type']:
+            update.append(entry)
+    delete = sorted(name for name in remote if name not in local_names) if prune else []
+    return create, update, delete
+
+@cli.command(name="sync")
+@click.argument('source', type=click.Path(exists=True))
+@click.option('--path', metavar='<path>', required=True, help='SSM path to reconcile, i.e. /my-app/dev')
+@click.option('--plan', is_flag=True, default=False, help='Print the changes without applying them')
+@click.option('--prune', is_flag=True, default=False, help='Delete parameters under <path> missing locally')
+@click.option('--encrypt', '-e', is_flag=True, default=False,
+              help='Store every parameter as a SecureString; otherwise existing ones keep their type')
+@click.option('--profile', '-p', metavar='<profile>', required=False, help='an aws profile')
+@click.option('--region', '-r', metavar='<region>', required=False, help='aws Region, i.e. us-east-1')
+def sync(source, path, plan, prune, encrypt, profile, region):
+    """Reconcile parameters under <path> with the local directory or file <source>."""
+    if not path.startswith('/'):
+        path = '/' + path
+    entries = load_tree(source, path, encrypt)
+    client = get_client(profile, region)
+    try:
+        remote = {}
+        for page in paginate(client, 'get_parameters_by_path', Path=path, Recursive=True, WithDecryption=True):
+            for param in page['Parameters']:
+                remote[param['Name']] = param
+    except Exception as e:
+        raise SSMXError("Error listing parameters: %s" % e)
+
+    create, update, delete = diff_tree(inherit_types(entries, remote), remote, prune)
+    changes = ([('create', entry['Name']) for entry in create] + [('update', entry['Name']) for entry in update] +
+               [('delete', name) for name in delete])
+    if not changes:
+        click.echo("Everything is in sync.")
+        return
+    if plan:
+        click.echo(tabulate({'Action': [action for action, _ in changes], 'Name': [name for _, name in changes]},
+                            headers='keys', tablefmt='grid'))
+        return
+
+    try:
+        # Rewritten secrets keep their KMS key unless the entry names one
+        keyless = [entry['Name'] for entry in update if entry['Type'] == 'SecureString' and not entry['KeyId']
+                   and remote[entry['Name']]['Type'] == 'SecureString']
+        metadata = request_metadata_by_name(client, keyless)
+        for entry in update:
+            if entry['Name'] in metadata:
+                entry['KeyId'] = metadata[entry['Name']].get('KeyId')
+        write_params(client, create + update)
+    except Exception as e:
+        raise SSMXError("Error putting parameters: %s" % e)
+    deleted, _ = delete_params(delete, profile, region)
+    for title, names in (('Created Parameters', [entry['Name'] for entry in create]),
+                         ('Updated Parameters', [entry['Name'] for entry in update]),
+                         ('Deleted Parameters', deleted)):
+        if names:
+            click.echo(tabulate({title: names}, headers='keys', tablefmt='grid'))
+
+
+
+
+
+
+def get_param(name, profile, region):
+    client = get_client(profile, region)
+    try:
+        response = call(client, 'get_parameter', Name=name, WithDecryption=True)
+    # TODO: catch  exceptions
+    except Exception as e:
+        raise SSMXError("Error getting parameters: %s\nParameter Name: %s" % (e, name))
+    return response.get('Parameter')
+
+def path_record(param):
+    """path_record keeps the fields of <param> the path helpers return."""
+    return dict(Name=param.get('Name'), Value=param.get('Value'), Version=param.get('Version'))
+
+
+def read_path_hints(hints_file):
+    """read_path_hints returns the sub-paths listed one per line in <hints_file>, for walk_path."""
+    with open(hints_file, 'r') as f:
+        return ['/' + hint.strip('/') for hint in read_names(f)]
+
+
+def walk_path(client, path, hints=(), workers=MAX_WORKERS):
+    """
+    walk_path lazily yields every parameter under <path>, recursively, the
+    same parameters the serial GetParametersByPath walk returns.
+
+    Without <hints>, the tree is paged serially, which only needs
+    ssm:GetParametersByPath. With <hints>, a tree larger than one page is
+    walked concurrently on <workers> threads: the hinted sub-paths are
+    paged by path while a describe_parameters listing of <path> (metadata
+    only, 50 names per page) finds the other parameters, fetched by name in
+    batches of 10. That also needs ssm:DescribeParameters and
+    ssm:GetParameters; if it fails (i.e. AccessDenied), the rest of the
+    tree is paged serially instead. Errors of the serial walk are raised.
+    """
+    def serial():
+        return (param for page in paginate(client, 'get_parameters_by_path', Path=path, Recursive=True,
+                                           WithDecryption=True, MaxResults=MAX_BY_PATH_RESULTS)
+                for param in page['Parameters'])
+
+    if not hints:
+        for param in serial():
+            yield path_record(param)
+        return
+
+    first = call(client, 'get_parameters_by_path', Path=path, Recursive=True, WithDecryption=True,
+                 MaxResults=MAX_BY_PATH_RESULTS)
+    metrics.count(client, 'get_parameters_by_path', 'pages')
+    for param in first['Parameters']:
+        yield path_record(param)
+    if not first.get('NextToken'):
+        return
+
+    seen = set(param['Name'] for param in first['Parameters'])
+    root = path.rstrip('/') + '/'
+    subtrees = [hint.rstrip('/') for hint in unique(hints) if hint.rstrip('/').startswith(root)]
+    # Hints nested in another hint are walked with their parent
+    subtrees = [subtree for subtree in subtrees if not any(subtree.startswith(other + '/') for other in subtrees)]
+
+    def walk(subtree):
+        return [path_record(param)
+                for page in paginate(client, 'get_parameters_by_path', Path=subtree, Recursive=True,
+                                     WithDecryption=True, MaxResults=MAX_BY_PATH_RESULTS)
+                for param in page['Parameters']]
+
+    def fetch(batch):
+        response = call(client, 'get_parameters', Names=batch, WithDecryption=True)
+        return [path_record(param) for param in response.get('Parameters', [])]
+
+    def fresh(records):
+        for record in records:
+            # The first page may overlap a hinted subtree
+            if record['Name'] not in seen:
+                seen.add(record['Name'])
+                yield record
+
+    try:
+        with thread_pool(workers) as executor:
+            pending = [executor.submit(walk, subtree) for subtree in subtrees]
+            batch = []
+            for page in paginate(client, 'describe_parameters', MaxResults=50,
+                                 ParameterFilters=[{'Key': 'Path', 'Option': 'Recursive', 'Values': [path]}]):
+                for param in page['Parameters']:
+                    name = param['Name']
+                    if name in seen or any(name.startswith(subtree + '/') for subtree in subtrees):
+                        continue
+                    batch.append(name)
+                    if len(batch) == MAX_NAMES_PER_CALL:
+                        pending.append(executor.submit(fetch, batch))
+                        batch = []
+                for future in [future for future in pending if future.done()]:
+                    pending.remove(future)
+                    for record in fresh(future.result()):
+                        yield record
+            if batch:
+                pending.append(executor.submit(fetch, batch))
+            for future in pending:
+                for record in fresh(future.result()):
+                    yield record
+    except Exception as e:
+        click.echo("Heads Up! Unable to walk %s concurrently (%s); paging it instead." % (path, e), err=True)
+        for param in serial():
+            if param['Name'] not in seen:
+                seen.add(param['Name'])
+                yield path_record(param)
+
+
+def request_parameters_by_path(client, path, hints=()):
+    """request_parameters_by_path returns every parameter under <path>, see walk_path. Errors are raised."""
+    return [param for param in walk_path(client, path, hints)]
+
+def get_parameters_by_path(path, profile, region, cache=None, hints=()):
+    """
+    get_parameters_by_path returns every parameter under <path>, recursively.
+    With <hints>, large trees are walked concurrently (see walk_path).
+
+    With a <cache>, a fresh entry is used as is and an expired entry is
+    revalidated by comparing parameter Versions; if SSM can't be reached,
+    the expired entry is served instead of failing. When an ssmx agent is
+    listening, it answers instead and <cache> is unused.
+    """
+    response = agent_request(dict(op='path', path=path, profile=profile, region=region))
+    if response is not None:
+        return response['params']
+    client = get_client(profile, region)
+    entry = cache.load('path', path) if cache else None
+    if entry and cache.is_fresh(entry):
+        return entry['params']
+    try:
+        if entry:
+            versions = request_versions(client, [{'Key': 'Path', 'Option': 'Recursive', 'Values': [path]}])
+            if versions == dict((param['Name'], param['Version']) for param in entry['params']):
+                cache.store('path', path, entry['params'])
+                return entry['params']
+        output = request_parameters_by_path(client, path, hints)
+    except Exception as e:
+        if entry:
+            click.echo("Heads Up! Unable to reach SSM (%s); using cached values." % e, err=True)
+            return entry['params']
+        raise SSMXError("Error listing parameters: %s" % e)
+    if cache:
+        cache.store('path', path, output)
+    return output
+
+
+def cache_dir():
+    """cache_dir returns the directory of the local parameter cache."""
+    if environ.get('SSMX_CACHE_DIR'):
+        return environ['SSMX_CACHE_DIR']
+    base = environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'ssmx')
+
+
+def agent_socket():
+    """agent_socket returns the path of the ssmx agent's socket, $SSMX_AGENT_SOCKET or <cache dir>/agent.sock."""
+    return environ.get('SSMX_AGENT_SOCKET') or os.path.join(cache_dir(), 'agent.sock')
+
+
+def caller_target(profile, region):
+    """
+    caller_target resolves <profile> and <region> the way this process's own
+    boto3 session would, from its environment and aws config, so an agent
+    started under another environment still serves this process's target.
+    The region is None when none is configured.
+    """
+    profile = profile or environ.get('AWS_PROFILE') or environ.get('AWS_DEFAULT_PROFILE') or None
+    if not region:
+        import boto3
+        try:
+            region = boto3.Session(profile_name=profile).region_name
+        except Exception:
+            region = environ.get('AWS_REGION') or environ.get('AWS_DEFAULT_REGION')
+    return profile, region
+
+
+def agent_request(request, socket_path=None):
+    """
+    agent_request sends <request> to the ssmx agent and returns its response,
+    or None when no agent answers in time or it can't serve the request, so
+    callers go to SSM directly. The profile and region of <request> are
+    resolved from this process's environment first (see caller_target).
+    Errors reported by the agent are raised.
+    """
+    socket_path = socket_path or agent_socket()
+    if not os.path.exists(socket_path):
+        return None
+    if request.get('op') != 'ping':
+        profile, region = caller_target(request.get('profile'), request.get('region'))
+        if region is None:
+            # Calling SSM directly reports the missing region
+            return None
+        request = dict(request, profile=profile, region=region)
+    import socket
+    timeout = float(environ.get('SSMX_AGENT_TIMEOUT') or AGENT_TIMEOUT)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(min(AGENT_CONNECT_TIMEOUT, timeout))
+    try:
+        sock.connect(socket_path)
+        sock.settimeout(timeout)
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        with contextlib.closing(sock.makefile('rb')) as f:
+            line = f.readline()
+    except socket.timeout:
+        click.echo("Heads Up! The ssmx agent at %s didn't answer; calling SSM directly." % socket_path, err=True)
+        return None
+    except socket.error:
+        # A socket left behind by an agent that is gone
+        return None
+    finally:
+        sock.close()
+    if not line:
+        return None
+    response = json.loads(line.decode('utf-8'))
+    if 'unavailable' in response:
+        return None
+    if 'error' in response:
+        raise SSMXError("Error getting parameters from the ssmx agent: %s" % response['error'])
+    return response
+
+
+def cache_record(param):
+    """cache_record keeps the fields of <param> worth caching."""
+    record = dict(Name=param.get('Name'), Value=param.get('Value'),
+                  Version=param.get('Version'), Type=param.get('Type'))
+    if param.get('Selector'):
+        record['Selector'] = param['Selector']
+    return record
+
+
+def write_private(path, data):
+    """write_private atomically writes <data> to <path>, readable only by the current user."""
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.rename(tmp_path, path)
+
+
+def load_fernet(directory, key=None):
+    """
+    load_fernet returns the cipher protecting cached values. The key is
+    <key>, $SSMX_CACHE_KEY, or is generated once into <directory>/key.
+    """
+    try:
+        from cryptography.fernet import Fernet
+    except ImportError:
+        raise SSMXError("Heads Up! The parameter cache requires the cryptography package; "
+                        "install it with pip install ssmx[cache]")
+    key = key or environ.get('SSMX_CACHE_KEY')
+    if key:
+        return Fernet(key.encode('utf-8'))
+    key_path = os.path.join(directory, 'key')
+    if not os.path.exists(key_path):
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        write_private(key_path, Fernet.generate_key())
+    with open(key_path, 'rb') as f:
+        return Fernet(f.read().strip())
+
+
+class ParamCache(object):
+    """
+    ParamCache keeps resolved parameters on disk, encrypted with a locally
+    held key and keyed by (profile, region, name or path). Entries older than
+    <ttl> seconds have to be revalidated before they are used. The profile
+    and region are resolved first (see caller_target), so targets picked
+    from the environment never share entries.
+    """
+
+    def __init__(self, ttl, profile, region, directory=None):
+        self.ttl = ttl
+        self.profile = profile
+        self.region = region
+        self.target = caller_target(profile, region)
+        self.directory = directory or cache_dir()
+        self.fernet = load_fernet(self.directory)
+
+    def entry_path(self, kind, name):
+        import hashlib
+        key = json.dumps(self.target + (kind, name))
+        return os.path.join(self.directory, 'params', hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+    def load(self, kind, name):
+        """load returns the entry for <name>, or None when missing or unreadable."""
+        try:
+            with open(self.entry_path(kind, name), 'rb') as f:
+                return json.loads(self.fernet.decrypt(f.read()).decode('utf-8'))
+        except Exception:
+            return None
+
+    def is_fresh(self, entry):
+        return time.time() - entry['validated_at'] < self.ttl
+
+    def store(self, kind, name, params):
+        """store saves <params> for <name>, marking them as validated now."""
+        path = self.entry_path(kind, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), 0o700)
+        entry = json.dumps(dict(validated_at=time.time(), params=params))
+        write_private(path, self.fernet.encrypt(entry.encode('utf-8')))
+
+
+class PinnedCache(object):
+    """
+    PinnedCache keeps parameters fetched at an exact version (name:3) on
+    disk. A version's value never changes, so entries never expire. They are
+    addressed by a hash of the resolved (profile, region), name and version,
+    encrypted like ParamCache, and the least recently used are evicted once they take more
+    than <max_bytes>.
+    """
+
+    def __init__(self, profile, region, max_bytes=DEFAULT_PINNED_CACHE_BYTES, directory=None):
+        self.profile = profile
+        self.region = region
+        self.target = caller_target(profile, region)
+        self.max_bytes = max_bytes
+        self.directory = directory or cache_dir()
+        self.fernet = load_fernet(self.directory)
+
+    def entry_path(self, name):
+        import hashlib
+        base, version = split_selector(name)
+        key = json.dumps(self.target + (base, int(version)))
+        return os.path.join(self.directory, 'pinned', hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+    def load(self, name):
+        """load returns the parameter cached for <name>, or None when missing or unreadable."""
+        path = self.entry_path(name)
+        try:
+            with open(path, 'rb') as f:
+                param = json.loads(self.fernet.decrypt(f.read()).decode('utf-8'))
+            # Eviction goes by modification time, so a read marks the entry as recently used
+            os.utime(path, None)
+        except Exception:
+            return None
+        return param
+
+    def store(self, params):
+        """
+        store saves the name -> parameter pairs of <params>, then evicts what
+        no longer fits. A cache that can't be written (i.e. on a read-only
+        filesystem) is skipped with a warning.
+        """
+        if not params:
+            return
+        directory = os.path.join(self.directory, 'pinned')
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory, 0o700)
+            for name, param in params.items():
+                record = json.dumps(cache_record(param))
+                write_private(self.entry_path(name), self.fernet.encrypt(record.encode('utf-8')))
+            self.evict()
+        except (IOError, OSError) as e:
+            click.echo("Heads Up! Unable to write the pinned cache: %s" % e, err=True)
+
+    def evict(self):
+        """evict removes the least recently used entries until the cache holds at most <max_bytes>."""
+        directory = os.path.join(self.directory, 'pinned')
+        entries = []
+        for entry in os.listdir(directory):
+            path = os.path.join(directory, entry)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+def pinned_cache(profile, region, enabled=False):
+    """
+    pinned_cache returns the PinnedCache of <profile> and <region>. Like the
+    parameter cache it is opt-in: it is None unless <enabled> or
+    $SSMX_PINNED_CACHE=1, and when $SSMX_PINNED_CACHE_BYTES is 0. A cache that
+    can't be opened (no cryptography, unwritable directory) is None too,
+    with a warning, so reads go to SSM.
+    """
+    if not (enabled or environ.get('SSMX_PINNED_CACHE') == '1'):
+        return None
+    max_bytes = int(environ.get('SSMX_PINNED_CACHE_BYTES', DEFAULT_PINNED_CACHE_BYTES))
+    if max_bytes <= 0:
+        return None
+    try:
+        return PinnedCache(profile, region, max_bytes)
+    except (SSMXError, IOError, OSError) as e:
+        click.echo("Heads Up! The pinned cache is unavailable: %s" % e, err=True)
+        return None
+
+
+def clear_cache(directory=None):
+    """clear_cache removes every cached entry, pinned ones included, keeping the encryption key."""
+    removed = 0
+    for kind in ('params', 'pinned'):
+        entries_dir = os.path.join(directory or cache_dir(), kind)
+        if not os.path.isdir(entries_dir):
+            continue
+        for entry in os.listdir(entries_dir):
+            os.remove(os.path.join(entries_dir, entry))
+            removed += 1
+    return removed
+
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS params (
+    name TEXT PRIMARY KEY,
+    type TEXT,
+    tier TEXT,
+    key_id TEXT,
+    version INTEGER,
+    modified TEXT,
+    metadata TEXT
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sync (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+class ParamIndex(object):
+    """
+    ParamIndex is an SQLite index of parameter metadata (never values) for
+    one (profile, region), resolved like ParamCache's, kept next to the
+    parameter cache. It answers name prefix, substring and path queries
+    locally, in name order.
+    """
+
+    def __init__(self, profile, region, directory=None):
+        import hashlib
+        self.profile = profile
+        self.region = region
+        key = json.dumps(caller_target(profile, region))
+        self.path = os.path.join(directory or cache_dir(), 'index',
+                                 hashlib.sha256(key.encode('utf-8')).hexdigest() + '.db')
+        self.conn = None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def connect(self):
+        if self.conn is None:
+            import sqlite3
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path), 0o700)
+            # Parameter names can be sensitive too
+            os.close(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600))
+            self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self.conn.executescript(INDEX_SCHEMA)
+        return self.conn
+
+    def synced_at(self):
+        """synced_at returns when the index was last synced, or None if it never was."""
+        if not self.exists():
+            return None
+        row = self.connect().execute("SELECT value FROM sync WHERE key = 'synced_at'").fetchone()
+        return float(row[0]) if row else None
+
+    def is_fresh(self, ttl):
+        synced_at = self.synced_at()
+        return synced_at is not None and time.time() - synced_at < ttl
+
+    def sync(self):
+        """
+        sync brings the index up to date. SSM can't list only the parameters
+        modified since a date, so every metadata page is read (50 per page,
+        no values), but only new or changed rows are written and deleted
+        parameters are removed.
+
+        Returns the number of rows written and removed.
+        """
+        conn = self.connect()
+        known = dict((name, (version, modified))
+                     for name, version, modified in conn.execute('SELECT name, version, modified FROM params'))
+        seen = set()
+        rows = []
+        try:
+            for page in paginate(get_client(self.profile, self.region), 'describe_parameters', MaxResults=50):
+                for param in page['Parameters']:
+                    name = param['Name']
+                    seen.add(name)
+                    modified = str(param.get('LastModifiedDate', ''))
+                    if known.get(name) == (param.get('Version'), modified):
+                        continue
+                    metadata = json.dumps(dict((field, param.get(field, '')) for field in LIST_FIELDS), default=str)
+                    rows.append((name, param.get('Type'), param.get('Tier'), param.get('KeyId'),
+                                 param.get('Version'), modified, metadata))
+        except Exception as e:
+            raise SSMXError("Error listing parameters: %s" % e)
+        removed = [(name,) for name in known if name not in seen]
+        with conn:
+            conn.executemany('INSERT OR REPLACE INTO params VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            conn.executemany('DELETE FROM params WHERE name = ?', removed)
+            conn.execute("INSERT OR REPLACE INTO sync VALUES ('synced_at', ?)", (repr(time.time()),))
+        return len(rows), len(removed)
+
+    def query(self, names=(), contains=(), path=None, recursive=False, types=(), tiers=(), key_id=None,
+              limit=None):
+        """
+        query lazily yields the metadata of the indexed parameters starting
+        with any of <names>, containing any of <contains> and matching the
+        other filters like list_query does.
+        """
+        clauses = []
+        args = []
+
+        def bounds(text):
+            # Every name starting with <text> sorts between these bounds, so the primary key is used
+            return [text, text + u'\U0010ffff']
+
+        if names:
+            clauses.append('(%s)' % ' OR '.join(['(name >= ? AND name < ?)'] * len(names)))
+            for name in names:
+                args.extend(bounds(name))
+        if contains:
+            clauses.append('(%s)' % ' OR '.join(['instr(name, ?) > 0'] * len(contains)))
+            args.extend(contains)
+        if path:
+            root = path.rstrip('/') + '/'
+            clauses.append('(name >= ? AND name < ?)')
+            args.extend(bounds(root))
+            if not recursive:
+                clauses.append("instr(substr(name, ?), '/') = 0")
+                args.append(len(root) + 1)
+        for column, values in (('type', types), ('tier', tiers), ('key_id', [key_id] if key_id else [])):
+            if values:
+                clauses.append('%s IN (%s)' % (column, ', '.join(['?'] * len(values))))
+                args.extend(values)
+        sql = 'SELECT metadata FROM params'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        sql += ' ORDER BY name'
+        if limit is not None:
+            sql += ' LIMIT %d' % limit
+        for row in self.connect().execute(sql, args):
+            yield json.loads(row[0])
+
+    def missing(self, names):
+        """missing returns those of <names> the index doesn't hold."""
+        found = set()
+        for batch in chunks(unique(names), 500):
+            found.update(row[0] for row in self.connect().execute(
+                'SELECT name FROM params WHERE name IN (%s)' % ', '.join(['?'] * len(batch)), batch))
+        return [name for name in unique(names) if name not in found]
+
+
+def validate_refs(env_file, profile, region):
+    """
+    validate_refs checks the ssm: refs of <env_file> against the local
+    metadata index before any value is fetched, and warns about the ones it
+    doesn't hold. The check is advisory: the index may be older than the
+    refs, so GetParameters decides what is invalid. Nothing is checked, and
+    nothing is synced, without an index.
+
+    Returns the refs missing from the index.
+    """
+    if not env_file:
+        return []
+    refs = [split_selector(value[4:])[0] for _, value in parse_env_file(env_file)
+            if value.startswith('ssm:') and not value.startswith('ssm:arn:')]
+    index = ParamIndex(profile, region) if refs else None
+    if index is None or not index.exists():
+        return []
+    try:
+        missing = index.missing(refs)
+    except Exception:
+        return []
+    if missing:
+        click.echo("Heads Up! Not in the local index, possibly misspelled: %s" % ', '.join(missing), err=True)
+    return missing
+
+
+@cli.group(name="cache")
+def cache_group():
+    """Manage the local parameter caches used by exec --cache-ttl and pinned versions."""
+
+
+@cache_group.command(name="clear")
+def cache_clear():
+    """Remove every cached parameter."""
+    removed = clear_cache()
+    click.echo("Removed %d cached entries." % removed)
+
+
+@cli.command(name="agent")
+@click.option('--socket', 'socket_path', metavar='<path>', envvar='SSMX_AGENT_SOCKET', required=False,
+              help='Unix socket to listen on, defaults to ~/.cache/ssmx/agent.sock')
+@click.option('--ttl', metavar='<seconds>', type=int, default=DEFAULT_AGENT_TTL, show_default=True,
+              help='Seconds parameters are served before being fetched again')
+@click.option('--socket-mode', metavar='<mode>', default='600', show_default=True,
+              help="Octal permissions of the socket; i.e. 660 lets the socket's group connect")
+def agent_command(socket_path, ttl, socket_mode):
+    """Serve cached parameters to the ssmx processes of this host over a Unix socket."""
+    from ssmx.agent import Agent
+    Agent(socket_path or agent_socket(), ttl, int(socket_mode, 8)).serve_forever()
+
+
+def parse_env_file(env_file):
+    """parse_env_file returns the (key, value) pairs declared in <env_file>."""
+    env_vars = []
+    with open(env_file, 'r') as f:
+        for line in f:
+            if line.startswith('#'):
+                continue
+            key, value = line.strip().split('=', 1)
+            env_vars.append((key, value))
+    return env_vars
+
+
+def formatKey(input):
+    """
+    formatKey converts the parameter key stored in ssm into
+    the traditional env. variable key format
+
+    examples:
+    /my-app/foo.bar -> FOO_BAR
+    /my-app/dev/hello-world -> HELLO_WORLD
+    /my-app/sbx/alpha/job_one -> JOB_ONE
+    """
+    paths = input.split('/')
+    keyName = paths[-1] # last item is key name
+    formattedKey = re.sub(r'[\.\-\_]', '_', keyName).upper()
+    return formattedKey
+
+def replace_process(command, env):
+    """
+    replace_process replaces the ssmx process image with <command> (execvpe),
+    so no interpreter stays resident next to it. It only returns on failure.
+    """
+    metrics.emit()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    try:
+        os.execvpe(command[0], command, env)
+    except OSError as e:
+        click.echo("Error executing %s: %s" % (command[0], e), err=True)
+        exit(127)
+
+
+def signal_name(name):
+    """
+    signal_name returns the canonical name of the signal <name> (SIGUSR1,
+    USR1 or usr1), raising click.BadParameter when this platform has no
+    such signal.
+    """
+    import signal
+    name = name.upper()
+    if not name.startswith('SIG'):
+        name = 'SIG' + name
+    if name.startswith('SIG_') or not isinstance(getattr(signal, name, None), int):
+        raise click.BadParameter("unknown signal %s." % name, param_hint="'--watch-signal'")
+    return name
+
+
+def run_supervised(command, env, watcher=None):
+    """
+    run_supervised runs <command> as a child process, forwarding SIGTERM,
+    SIGINT and SIGHUP to it, and returns its exit status. Like a shell,
+    a child killed by a signal reports 128 + the signal number.
+
+    With a <watcher>, parameters are polled while the child runs. When one
+    changes, the child is either sent the watcher's signal or restarted
+    with the refreshed environment.
+    """
+    import signal
+    from subprocess32 import Popen, TimeoutExpired
+
+    def spawn(env):
+        return Popen(command,
+                universal_newlines=True,
+                bufsize=0,
+                shell=False,
+                env=env)
+
+    try:
+        with metrics.phase('spawn'):
+            child = [spawn(env)]
+    except OSError as e:
+        click.echo("Error executing %s: %s" % (command[0], e), err=True)
+        return 127
+    # Startup is over once the command runs, report now rather than when it exits
+    metrics.emit()
+
+    def forward(signum, frame):
+        child[0].send_signal(signum)
+
+    previous = {}
+    for name in FORWARDED_SIGNALS:
+        signum = getattr(signal, name, None)
+        if signum is not None:
+            previous[signum] = signal.signal(signum, forward)
+    try:
+        while True:
+            try:
+                returncode = child[0].wait(timeout=watcher.next_poll() if watcher else None)
+                break
+            except TimeoutExpired:
+                pass
+            try:
+                changed = watcher.poll()
+            except Exception as e:
+                click.echo("Heads Up! Unable to check parameters for changes: %s" % e, err=True)
+                continue
+            if not changed:
+                continue
+            if watcher.action == 'signal':
+                click.echo("Parameters changed, sending %s" % watcher.signal_name, err=True)
+                child[0].send_signal(getattr(signal, watcher.signal_name))
+                continue
+            click.echo("Parameters changed, restarting", err=True)
+            child[0].terminate()
+            try:
+                child[0].wait(timeout=RESTART_TIMEOUT)
+            except TimeoutExpired:
+                child[0].kill()
+                child[0].wait()
+            env = environ.copy()
+            env.update(watcher.env(warn=False)[0])
+            child[0] = spawn(env)
+    finally:
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+
+    if returncode < 0:
+        return 128 - returncode
+    return returncode
+
+def resolve_refs(env_vars, profile, region, cache=None, pinned=False):
+    """
+    resolve_refs fetches the parameters behind the ssm: refs of <env_vars>,
+    failing with every invalid name at once. Returns name -> parameter.
+    See fetch_params for <pinned>.
+    """
+    # Collect every ssm: reference up front so they can be fetched in batches
+    secret_keys = [value[4:] for _, value in env_vars if value.startswith('ssm:')]
+    if not secret_keys:
+        return {}
+    params, invalid = fetch_params(secret_keys, profile, region, cache=cache, pinned=pinned)
+    if invalid:
+        raise SSMXError("Error getting parameters: Invalid Parameters: %s" % ', '.join(invalid))
+    return params
+
+
+def resolve_paths(names, profile, region, cache=None, hints=()):
+    """
+    resolve_paths fetches the parameters under each of <names> concurrently,
+    in the order given, splitting large paths along the sub-paths <hints>.
+    """
+    paths = [n if n.startswith('/') else '/' + n for n in names]
+
+    def fetch(path):
+        return get_parameters_by_path(path, profile, region, cache=cache, hints=hints)
+
+    with thread_pool(MAX_WORKERS) as executor:
+        return [params for params in executor.map(fetch, paths)]
+
+
+def read_pins(pin_file):
+    """
+    read_pins returns name -> selector for the name:version or name:label
+    entries listed one per line in <pin_file>.
+    """
+    pins = {}
+    with open(pin_file, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            name, selector = split_selector(line)
+            if not selector:
+                raise SSMXError("Error reading %s: %s isn't pinned to a version or label" % (pin_file, line))
+            pins[name] = selector
+    return pins
+
+
+def pin_refs(env_vars, pins):
+    """pin_refs adds the selector <pins> holds to the ssm: refs of <env_vars> that have none."""
+    pinned = []
+    for key, value in env_vars:
+        if value.startswith('ssm:') and split_selector(value[4:])[1] is None and value[4:] in pins:
+            value = '%s:%s' % (value, pins[value[4:]])
+        pinned.append((key, value))
+    return pinned
+
+
+def resolve_pinned_paths(names, pins, profile, region, cache=None, pinned=True):
+    """
+    resolve_pinned_paths returns, for each of <names>, the parameters of
+    <pins> under that path, recursively, fetched at their pinned selector.
+    The paths themselves aren't listed, so the manifest decides what a
+    release holds.
+    """
+    paths = [(n if n.startswith('/') else '/' + n).rstrip('/') + '/' for n in names]
+    refs = [['%s:%s' % (name, pins[name]) for name in sorted(pins) if name.startswith(path)] for path in paths]
+    params, invalid = fetch_params([ref for path_refs in refs for ref in path_refs], profile, region, cache=cache,
+                                   pinned=pinned)
+    if invalid:
+        raise SSMXError("Error getting parameters: Invalid Parameters: %s" % ', '.join(invalid))
+    return [[params[ref] for ref in path_refs] for path_refs in refs]
+
+
+def current_versions(env_file, names, profile, region):
+    """
+    current_versions returns name -> current Version for the ssm: refs of
+    <env_file> by name, without a selector, and every parameter under <names>,
+    from metadata only; nothing is decrypted.
+    """
+    refs = []
+    if env_file:
+        refs = [name for name in unique(value[4:] for _, value in parse_env_file(env_file)
+                                        if value.startswith('ssm:') and not value.startswith('ssm:arn:')
+                                        and split_selector(value[4:])[1] is None)]
+    client = get_client(profile, region)
+    try:
+        versions = request_versions_by_name(client, refs)
+        for name in names:
+            path = name if name.startswith('/') else '/' + name
+            versions.update(request_versions(client, [{'Key': 'Path', 'Option': 'Recursive', 'Values': [path]}]))
+    except Exception as e:
+        raise SSMXError("Error getting parameters: %s" % e)
+    invalid = [ref for ref in refs if ref not in versions]
+    if invalid:
+        raise SSMXError("Error getting parameters: Invalid Parameters: %s" % ', '.join(invalid))
+    return versions
+
+
+def build_env(env_vars, params, path_params, warn=True):
+    """
+    build_env assembles the exec environment from the (key, value) pairs of
+    an env file, their ssm: refs looked up in <params>, then the parameters of
+    each path in <path_params>.
+
+    Returns the env. variables and, for every variable coming from SSM, the
+    Name and Version of its parameter.
+    """
+    env_dict = {}
+    sources = {}
+    for key, value in env_vars:
+        if value.startswith('ssm:'):
+            param = params[value[4:]]
+            value = param['Value']
+            sources[key] = dict(Name=param['Name'], Version=param.get('Version'))
+            if param.get('Selector'):
+                sources[key]['Selector'] = param['Selector']
+        env_dict[key] = value
+
+    # Later paths win; within a path, parameters are applied in name order
+    for path in path_params:
+        for param in sorted(path, key=lambda param: param['Name']):
+            key = formatKey(param['Name'])
+            if key in sources and warn:
+                click.echo("Heads Up! %s from %s overrides %s" % (key, param['Name'], sources[key]['Name']),
+                           err=True)
+            sources[key] = dict(Name=param['Name'], Version=param.get('Version'))
+            if param.get('Selector'):
+                sources[key]['Selector'] = param['Selector']
+            env_dict[key] = param['Value']
+    return env_dict, sources
+
+
+def resolve_env(env_file, names, profile, region, cache=None, hints=(), pins=None, pinned=False):
+    """
+    resolve_env builds the environment for exec from the ssm: refs and plain
+    values of <env_file>, then from the parameters under each of <names>.
+    With <pins> (see read_pins), refs and paths are resolved at the pinned
+    versions instead, and <pinned> uses the PinnedCache for them.
+    See build_env for what is returned.
+    """
+    env_vars = parse_env_file(env_file) if env_file else []
+    if pins is not None:
+        env_vars = pin_refs(env_vars, pins)
+    params = resolve_refs(env_vars, profile, region, cache=cache, pinned=pinned)
+    if pins is not None:
+        path_params = resolve_pinned_paths(names, pins, profile, region, cache=cache, pinned=pinned) if names else []
+    else:
+        path_params = resolve_paths(names, profile, region, cache=cache, hints=hints) if names else []
+    return build_env(env_vars, params, path_params)
+
+
+def load_env(names=(), env_file=None, profile=None, region=None, ttl=DEFAULT_ENV_TTL, update_environ=False):
+    """
+    load_env resolves parameters in-process the way `ssmx exec` does: the
+    ssm: refs and plain values of <env_file>, then the parameters under each
+    path in <names>, keyed like formatKey. No subprocess is involved.
+
+    Results are memoized per (names, env_file, profile, region) for <ttl>
+    seconds; refresh() forgets them. With <update_environ>, the variables
+    are also set in os.environ.
+
+    Returns a dict of env. variables. Raises SSMXError when parameters can't
+    be resolved.
+    """
+    if isinstance(names, str):
+        names = (names,)
+    key = (tuple(names), env_file, profile, region)
+    with _env_memo_lock:
+        entry = _env_memo.get(key)
+        if entry is None or time.time() - entry[0] >= ttl:
+            env_vars = parse_env_file(env_file) if env_file else []
+            params = resolve_refs(env_vars, profile, region)
+            path_params = resolve_paths(names, profile, region) if names else []
+            entry = (time.time(), build_env(env_vars, params, path_params, warn=False)[0])
+            _env_memo[key] = entry
+    env = dict(entry[1])
+    if update_environ:
+        environ.update(env)
+    return env
+
+
+def refresh():
+    """refresh forgets every environment memoized by load_env, so the next call fetches again."""
+    with _env_memo_lock:
+        _env_memo.clear()
+
+
+def resolve_with_fallback(targets, timeout, resolve):
+    """
+    resolve_with_fallback calls resolve(profile, region) for the first of
+    <targets>, moving on to the next one when it fails or goes <timeout>
+    seconds without an SSM response. A large resolution that keeps getting
+    answers is waited on however long it takes. The last target is given
+    as long as it needs.
+
+    An abandoned target's client makes no more calls, so it doesn't draw on
+    the rate limiter and retry budget the fallback uses.
+
+    Returns the profile and region that answered, and their result.
+    """
+    for i, (profile, region) in enumerate(targets):
+        if i == len(targets) - 1:
+            return profile, region, resolve(profile, region)
+        result = {}
+
+        def run(profile, region):
+            try:
+                result['value'] = resolve(profile, region)
+            except Exception as e:
+                result['error'] = e
+
+        started = time.time()
+        # A slow target is left behind rather than waited on
+        thread = threading.Thread(target=run, args=(profile, region))
+        thread.daemon = True
+        thread.start()
+        client = get_client(profile, region)
+        while thread.is_alive():
+            idle_until = max(started, _last_response.get(id(client), 0)) + timeout
+            if time.time() >= idle_until:
+                _abandoned.add(id(client))
+                break
+            thread.join(idle_until - time.time())
+        if 'value' in result:
+            return profile, region, result['value']
+        reason = result.get('error') or 'no answer for %ss' % timeout
+        click.echo("Heads Up! %s failed (%s); falling back to %s" % (
+            target_label(profile, region), reason, target_label(*targets[i + 1])), err=True)
+
+
+class EnvWatcher(object):
+    """
+    EnvWatcher keeps the exec environment up to date for exec --watch.
+    Each poll compares parameter Versions from batched describe_parameters
+    metadata, and only the parameters that changed are fetched again. Refs
+    pinned to a version never change; refs selecting a label are fetched
+    again whenever their parameter gets a new version, to see if the label
+    moved.
+    """
+
+    def __init__(self, env_file, names, profile, region, interval, jitter, action, signal_name, cache=None):
+        self.profile = profile
+        self.region = region
+        self.interval = interval
+        self.jitter = jitter
+        self.action = action
+        self.signal_name = signal_name
+        self.env_vars = parse_env_file(env_file) if env_file else []
+        self.paths = [n if n.startswith('/') else '/' + n for n in names]
+        self.refs = resolve_refs(self.env_vars, profile, region, cache=cache)
+        self.path_params = resolve_paths(self.paths, profile, region, cache=cache) if names else []
+        # label ref -> latest Version of its parameter when the label was last checked
+        self.label_checks = {}
+
+    def env(self, warn=True):
+        return build_env(self.env_vars, self.refs, self.path_params, warn=warn)
+
+    def next_poll(self):
+        """next_poll returns the seconds until the next poll, jittered so a fleet doesn't poll in step."""
+        return self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def poll(self):
+        """poll refreshes the parameters whose Version changed and tells whether anything did."""
+        client = get_client(self.profile, self.region)
+        changed = []
+        relabeled = []
+        bases = dict((name, split_selector(name)[0]) for name in self.refs if pinned_version(name) is None)
+        versions = request_versions_by_name(client, sorted(set(bases.values())))
+        for name, base in sorted(bases.items()):
+            if base not in versions:
+                continue
+            if name == base and versions[base] != self.refs[name].get('Version'):
+                changed.append(name)
+            elif name != base and versions[base] != self.label_checks.get(name):
+                self.label_checks[name] = versions[base]
+                relabeled.append(name)
+        path_versions = [request_versions(client, [{'Key': 'Path', 'Option': 'Recursive', 'Values': [path]}])
+                         for path in self.paths]
+        membership_changed = False
+        for versions, params in zip(path_versions, self.path_params):
+            current = dict((param['Name'], param.get('Version')) for param in params)
+            membership_changed = membership_changed or set(current) != set(versions)
+            changed.extend(name for name, version in versions.items() if current.get(name) != version)
+        if not (changed or relabeled or membership_changed):
+            return False
+
+        fetched, _ = request_params(client, [name for name in unique(changed + relabeled)])
+        moved = [name for name in relabeled
+                 if name in fetched and fetched[name].get('Version') != self.refs[name].get('Version')]
+        if not (changed or moved or membership_changed):
+            return False
+        for name in self.refs:
+            if name in fetched:
+                self.refs[name] = fetched[name]
+        for index, versions in enumerate(path_versions):
+            known = dict((param['Name'], param) for param in self.path_params[index])
+            self.path_params[index] = [fetched.get(name) or known[name] for name in sorted(versions)
+                                       if name in fetched or name in known]
+        return True
+
+
+def snapshot_fernet(key_file=None):
+    """
+    snapshot_fernet returns the cipher of snapshots. Snapshots are read on
+    other hosts, so their key is never generated: it is read from <key_file>
+    or $SSMX_CACHE_KEY.
+    """
+    if key_file:
+        with open(key_file, 'r') as f:
+            key = f.read().strip()
+    else:
+        key = environ.get('SSMX_CACHE_KEY')
+    if not key:
+        raise SSMXError("Snapshots need a key shared with the hosts reading them: "
+                        "set $SSMX_CACHE_KEY or pass --key-file")
+    try:
+        return load_fernet(None, key)
+    except ValueError as e:
+        raise SSMXError("Error loading the snapshot key: %s" % e)
+
+
+def write_snapshot(path, env_dict, sources, profile, region, key_file=None):
+    """
+    write_snapshot saves a resolved environment to <path>, compressed and
+    encrypted with the snapshot key, along with the parameter versions it
+    holds.
+    """
+    import zlib
+    fernet = snapshot_fernet(key_file)
+    snapshot = dict(profile=profile, region=region, created_at=time.time(), env=env_dict, sources=sources)
+    data = zlib.compress(json.dumps(snapshot, separators=(',', ':')).encode('utf-8'))
+    write_private(path, fernet.encrypt(data))
+
+
+def read_snapshot(path, key_file=None):
+    """read_snapshot returns the env. variables, sources, profile and region saved in a snapshot."""
+    import zlib
+    fernet = snapshot_fernet(key_file)
+    with open(path, 'rb') as f:
+        token = f.read()
+    try:
+        snapshot = json.loads(zlib.decompress(fernet.decrypt(token)).decode('utf-8'))
+    except Exception:
+        raise SSMXError("Error reading snapshot %s: it is corrupt or was encrypted with another key" % path)
+    return snapshot['env'], snapshot['sources'], snapshot['profile'], snapshot['region']
+
+
+def verify_snapshot(sources, profile, region):
+    """
+    verify_snapshot compares the versions recorded in a snapshot with the
+    current ones, using batched metadata calls, and warns about any drift.
+    """
+    # Pinned versions are expected to fall behind
+    expected = dict((source['Name'], source['Version']) for source in sources.values() if not source.get('Selector'))
+    client = get_client(profile, region)
+    try:
+        versions = request_versions_by_name(client, sorted(expected))
+    except Exception as e:
+        click.echo("Heads Up! Unable to verify the snapshot versions: %s" % e, err=True)
+        return
+    stale = [name for name in sorted(expected) if versions.get(name) != expected[name]]
+    if stale:
+        click.echo("Heads Up! The snapshot is out of date for: %s" % ', '.join(stale), err=True)
+    return stale
+
+@cli.command(name="export")
+@click.option('--env-file', '-f', metavar='<env_file>', required=False, help='filepath for .env file')
+@click.option('--name', '-n', metavar='<name>', multiple=True, required=False,
+              help='prefix-name of parameters, i.e. /<prefix-name>/hello-world. Repeatable, later names take precedence')
+@click.option('--output', '-o', metavar='<file>', required=True, help='file to write the snapshot to')
+@click.option('--key-file', metavar='<file>', type=click.Path(exists=True, dir_okay=False), required=False,
+              help='file holding the snapshot key, defaults to $SSMX_CACHE_KEY')
+@click.option('--profile', '-p', metavar='<profile>', required=False, help='an aws profile')
+@click.option('--region', '-r', metavar='<region>', required=False, help='aws Region, i.e. us-east-1')
+def export(env_file, name, output, key_file, profile, region):
+    """Save the environment exec would inject into an encrypted snapshot."""
+    if not (env_file or name):
+        raise click.UsageError("Missing option '--env-file' or '--name'.")
+    # Fail before resolving anything when there is no key
+    snapshot_fernet(key_file)
+    env_dict, sources = resolve_env(env_file, name, profile, region)
+    write_snapshot(output, env_dict, sources, profile, region, key_file=key_file)
+    click.echo("Exported %d variables to %s" % (len(env_dict), output))
+
+
+@cli.command(name="pin")
+@click.option('--env-file', '-f', metavar='<env_file>', required=False, help='filepath for .env file')
+@click.option('--name', '-n', metavar='<name>', multiple=True, required=False,
+              help='prefix-name of parameters, i.e. /<prefix-name>/hello-world. Repeatable')
+@click.option('--output', '-o', metavar='<file>', required=True, help='file to write the manifest to')
+@click.option('--profile', '-p', metavar='<profile>', required=False, help='an aws profile')
+@click.option('--region', '-r', metavar='<region>', required=False, help='aws Region, i.e. us-east-1')
+def pin(env_file, name, output, profile, region):
+    """Write a manifest of the current versions of the parameters exec would inject, for exec --pin."""
+    if not (env_file or name):
+        raise click.UsageError("Missing option '--env-file' or '--name'.")
+    versions = current_versions(env_file, name, profile, region)
+    with open(output, 'w') as f:
+        for param_name in sorted(versions):
+            f.write('%s:%d\n' % (param_name, versions[param_name]))
+    click.echo("Pinned %d parameters in %s" % (len(versions), output))
+
+
+@cli.command(name="exec", help='Inject env variables into an executable')
+@click.argument('command', nargs=-1, required=False, type=click.UNPROCESSED)
+@click.option('--env-file', '-f', metavar='<env_file>', required=False, help='filepath for .env file')
+@click.option('--name', '-n', metavar='<name>', multiple=True, required=False,
+              help='prefix-name of parameters, i.e. /<prefix-name>/hello-world. Repeatable, later names take precedence',
+              **completion(complete_paths))
+@click.option('--profile', '-p', metavar='<profile>', multiple=True,
+              help='an aws profile. Repeatable: later profiles are fallbacks')
+@click.option('--region', '-r', metavar='<region>', multiple=True,
+              help='aws Region, i.e. us-east-1. Repeatable: the first is the primary, the others ordered fallbacks')
+@click.option('--fallback-timeout', metavar='<seconds>', type=float, default=DEFAULT_FALLBACK_TIMEOUT,
+              show_default=True, help='move on to the next region when one goes <seconds> without an answer')
+@click.option('--path-hints', metavar='<file>', type=click.Path(exists=True, dir_okay=False), envvar='SSMX_PATH_HINTS',
+              required=False, help='file listing sub-paths of <name>, one per line, to fetch concurrently')
+@click.option('--pin', 'pin_file', metavar='<file>', type=click.Path(exists=True, dir_okay=False), envvar='SSMX_PIN',
+              required=False, help='manifest written by ssmx pin; resolve parameters at the versions it lists, cached on disk')
+@click.option('--cache-ttl', metavar='<seconds>', type=int, envvar='SSMX_CACHE_TTL', required=False,
+              help='cache resolved parameters on disk, revalidating them after <seconds>')
+@click.option('--no-cache', is_flag=True, default=False, help='Ignore the local parameter caches')
+@click.option('--replace', is_flag=True, default=False,
+              help='Replace the ssmx process with the command instead of supervising it')
+@click.option('--from-snapshot', 'snapshot', metavar='<file>', type=click.Path(exists=True, dir_okay=False),
+              required=False, help='inject the environment saved by ssmx export, without calling AWS')
+@click.option('--verify-versions', is_flag=True, default=False,
+              help='With --from-snapshot, check in the background that the snapshot versions are current')
+@click.option('--key-file', metavar='<file>', type=click.Path(exists=True, dir_okay=False), required=False,
+              help='With --from-snapshot, file holding the snapshot key, defaults to $SSMX_CACHE_KEY')
+@click.option('--watch', metavar='<seconds>', type=click.FloatRange(min=MIN_WATCH_INTERVAL), required=False,
+              help='poll parameters for changes every <seconds> and reload the command')
+@click.option('--watch-jitter', metavar='<fraction>', type=click.FloatRange(0, MAX_WATCH_JITTER),
+              default=0.2, show_default=True, help='randomise each --watch interval by up to this fraction')
+@click.option('--watch-action', type=click.Choice(['restart', 'signal']), default='restart', show_default=True,
+              help='restart the command with the new values, or send it --watch-signal')
+@click.option('--watch-signal', metavar='<signal>', default='SIGHUP', show_default=True,
+              help='signal sent on changes with --watch-action signal')
+def execute(command, env_file, name, profile, region, fallback_timeout, path_hints, pin_file, cache_ttl, no_cache,
+            replace, snapshot, verify_versions, key_file, watch, watch_jitter, watch_action, watch_signal):
+    """Inject env. variables into an executable via <name> and/or <env_file>"""
+
+    # command is a tuple
+    if len(command) == 0:
+        click.echo("nothing to execute")
+        return
+
+    def make_cache(profile, region):
+        if cache_ttl is not None and not no_cache:
+            return ParamCache(cache_ttl, profile, region)
+        return None
+
+    targets = expand_targets(profile, region)
+    profile, region = targets[0]
+    hints = read_path_hints(path_hints) if path_hints else []
+    pins = read_pins(pin_file) if pin_file else None
+    watcher = None
+    if snapshot:
+        if env_file or name or watch or pin_file:
+            raise click.UsageError("--from-snapshot can't be combined with --env-file, --name, --pin or --watch.")
+        env_dict, sources, snapshot_profile, snapshot_region = read_snapshot(snapshot, key_file=key_file)
+        profile = profile or snapshot_profile
+        region = region or snapshot_region
+    elif watch:
+        if replace:
+            raise click.UsageError("--watch can't be combined with --replace.")
+        if pin_file:
+            raise click.UsageError("--watch can't be combined with --pin; pinned versions don't change.")
+        watch_signal = signal_name(watch_signal)
+        with metrics.phase('resolve'):
+            watcher = EnvWatcher(env_file, name, profile, region, watch, watch_jitter, watch_action,
+                                 watch_signal, cache=make_cache(profile, region))
+        env_dict, sources = watcher.env()
+    else:
+        def resolve(profile, region):
+            return resolve_env(env_file, name, profile, region, cache=make_cache(profile, region), hints=hints,
+                               pins=pins, pinned=pins is not None and not no_cache)
+
+        if len(targets) == 1:
+            validate_refs(env_file, profile, region)
+
+        with metrics.phase('resolve'):
+            profile, region, (env_dict, sources) = resolve_with_fallback(targets, fallback_timeout, resolve)
+    for key in env_dict:
+        click.echo("injected %s" % key)
+
+    cmd_env = environ.copy()
+    cmd_env.update(env_dict)
+
+    if snapshot and verify_versions:
+        # The check can't outlive the ssmx process when it is replaced
+        if replace:
+            verify_snapshot(sources, profile, region)
+        else:
+            threading.Thread(target=verify_snapshot, args=(sources, profile, region)).start()
+
+    rate_limiter.report()
+    if replace:
+        replace_process(command, cmd_env)
+    exit(run_supervised(command, cmd_env, watcher=watcher))
+
+
+IMPORT_DURATION = time.time() - IMPORT_STARTED
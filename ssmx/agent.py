@@ -0,0 +1,269 @@
+"""
+ssmx.agent serves parameters to the ssmx processes of a host over a Unix
+domain socket, so they share one session, one set of credentials and one
+in-memory cache instead of each calling SSM.
+
+Every connection carries one request and one response, each a json line:
+
+    {"op": "names", "names": ["a", "b"], "profile": null, "region": null}
+        -> {"params": {"a": {...}}, "invalid": ["b"]}
+    {"op": "path", "path": "/my-app", "profile": null, "region": null}
+        -> {"params": [{...}, ...]}
+    {"op": "ping"}
+        -> {"pong": true}
+
+Clients send the profile and region their own environment resolves to
+(see ssmx.caller_target). Requests the agent can't serve as the client
+would, i.e. for the default profile while the agent runs under
+AWS_PROFILE, are answered with {"unavailable": <reason>} and the client
+calls SSM itself. Failures are answered with {"error": <message>}.
+"""
+import json
+import os
+import signal
+import sys
+import threading
+import time
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+import click
+
+from ssmx import (SSMXError, agent_request, cache_record, get_client, request_parameters_by_path,
+                  request_params, unique)
+
+# Entries are refreshed in the background once they are this far into their TTL
+REFRESH_AHEAD = 0.75
+# Entries nobody asked for in this many TTLs are dropped instead of refreshed
+IDLE_TTLS = 10
+
+
+class Flight(object):
+    """Flight is an upstream fetch other requests for the same key can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class AgentCache(object):
+    """
+    AgentCache holds the parameters served by the agent, keyed by kind
+    ('name' or 'path'), profile, region and name. Entries older than <ttl>
+    are fetched again, and concurrent fetches of the same key are collapsed
+    into a single upstream fetch.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.flights = {}
+
+    def get(self, keys, fetch, refresh=False):
+        """
+        get returns key -> value for <keys>. Fresh entries come from memory.
+        The other keys are fetched with one call to <fetch>(keys), except the
+        keys another request is already fetching, whose result is awaited.
+        If the fetch fails, expired entries are served instead.
+        """
+        now = time.time()
+        values = {}
+        owned = []
+        waiting = {}
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry and not refresh:
+                    entry['used_at'] = now
+                if entry and not refresh and now - entry['fetched_at'] < self.ttl:
+                    values[key] = entry['value']
+                elif key in self.flights:
+                    waiting[key] = self.flights[key]
+                else:
+                    self.flights[key] = Flight()
+                    owned.append(key)
+
+        if owned:
+            try:
+                fetched = fetch(owned)
+                error = None
+            except Exception as e:
+                fetched = {}
+                error = e
+            with self.lock:
+                for key in owned:
+                    flight = self.flights.pop(key)
+                    entry = self.entries.get(key)
+                    if error is None:
+                        flight.value = fetched.get(key)
+                        self.entries[key] = dict(value=flight.value, fetched_at=time.time(),
+                                                 used_at=entry['used_at'] if entry else now)
+                    elif entry:
+                        flight.value = entry['value']
+                    else:
+                        flight.error = error
+                    flight.done.set()
+                    waiting[key] = flight
+            if error is not None:
+                click.echo("Heads Up! Unable to reach SSM (%s)" % error, err=True)
+
+        for key, flight in waiting.items():
+            flight.done.wait()
+            if flight.error is not None:
+                raise SSMXError(str(flight.error))
+            values[key] = flight.value
+        return values
+
+    def due(self):
+        """
+        due drops the entries nobody asked for lately and returns the keys of
+        the others that should be refreshed.
+        """
+        now = time.time()
+        with self.lock:
+            for key in [key for key, entry in self.entries.items()
+                        if now - entry['used_at'] > self.ttl * IDLE_TTLS]:
+                del self.entries[key]
+            return [key for key, entry in self.entries.items()
+                    if now - entry['fetched_at'] >= self.ttl * REFRESH_AHEAD]
+
+
+def fetcher(kind, profile, region):
+    """fetcher returns the function fetching keys of <kind> from SSM, for AgentCache.get."""
+    def fetch_names(keys):
+        params, _ = request_params(get_client(profile, region), [key[3] for key in keys])
+        return dict((key, cache_record(params[key[3]]) if key[3] in params else None) for key in keys)
+
+    def fetch_paths(keys):
+        return dict((key, request_parameters_by_path(get_client(profile, region), key[3])) for key in keys)
+
+    return fetch_names if kind == 'name' else fetch_paths
+
+
+class AgentServer(socketserver.ThreadingUnixStreamServer):
+    # A host restart connects dozens of processes at once; the default backlog of 5 would turn them away
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class Agent(object):
+    """
+    Agent listens on <socket_path>, created with the permissions <mode>,
+    and answers from an AgentCache refreshed in the background.
+    """
+
+    def __init__(self, socket_path, ttl, mode=0o600):
+        self.socket_path = socket_path
+        self.mode = mode
+        self.cache = AgentCache(ttl)
+        self.stopped = threading.Event()
+        self.server = None
+
+    def handle(self, request):
+        """handle answers a single request."""
+        profile = request.get('profile')
+        region = request.get('region')
+        own_profile = os.environ.get('AWS_PROFILE') or os.environ.get('AWS_DEFAULT_PROFILE')
+        if request.get('op') in ('names', 'path') and profile is None and own_profile:
+            # Without a profile, the agent's clients would use its own rather than the default one
+            return dict(unavailable='the agent runs under profile %s' % own_profile)
+        try:
+            if request.get('op') == 'names':
+                keys = [('name', profile, region, name) for name in unique(request['names'])]
+                values = self.cache.get(keys, fetcher('name', profile, region))
+                return dict(params=dict((key[3], values[key]) for key in keys if values[key] is not None),
+                            invalid=[key[3] for key in keys if values[key] is None])
+            if request.get('op') == 'path':
+                key = ('path', profile, region, request['path'])
+                return dict(params=self.cache.get([key], fetcher('path', profile, region))[key])
+            if request.get('op') == 'ping':
+                return dict(pong=True)
+            return dict(error='Unknown request %s' % request.get('op'))
+        except Exception as e:
+            return dict(error=str(e))
+
+    def refresh(self):
+        """refresh fetches the entries close to expiring again, grouped by kind, profile and region."""
+        groups = {}
+        for key in self.cache.due():
+            groups.setdefault(key[:3], []).append(key)
+        for group, keys in groups.items():
+            try:
+                self.cache.get(keys, fetcher(*group), refresh=True)
+            except Exception as e:
+                click.echo("Heads Up! Unable to refresh parameters: %s" % e, err=True)
+
+    def refresh_loop(self):
+        interval = max(1.0, self.cache.ttl * (1 - REFRESH_AHEAD))
+        while not self.stopped.wait(interval):
+            self.refresh()
+
+    def listen(self):
+        """listen binds the socket, readable and writable only as <mode> allows."""
+        directory = os.path.dirname(self.socket_path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        if os.path.exists(self.socket_path):
+            if agent_request(dict(op='ping'), self.socket_path) is not None:
+                raise SSMXError("Heads Up! An agent is already listening on %s" % self.socket_path)
+            os.unlink(self.socket_path)
+
+        agent = self
+
+        class Handler(socketserver.StreamRequestHandler):
+
+            def handle(self):
+                line = self.rfile.readline()
+                if not line:
+                    return
+                try:
+                    response = agent.handle(json.loads(line.decode('utf-8')))
+                except ValueError as e:
+                    response = dict(error='Invalid request: %s' % e)
+                self.wfile.write(json.dumps(response, default=str).encode('utf-8') + b'\n')
+
+        # No one else may connect before the permissions are set
+        umask = os.umask(0o177)
+        try:
+            self.server = AgentServer(self.socket_path, Handler)
+        finally:
+            os.umask(umask)
+        os.chmod(self.socket_path, self.mode)
+        refresher = threading.Thread(target=self.refresh_loop)
+        refresher.daemon = True
+        refresher.start()
+
+    def start(self):
+        """start serves requests on a background thread."""
+        self.listen()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.server.shutdown()
+        self.server.server_close()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def serve_forever(self):
+        """serve_forever serves requests until SIGTERM or SIGINT, then removes the socket."""
+        self.listen()
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        click.echo("ssmx agent listening on %s" % self.socket_path, err=True)
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stopped.set()
+            self.server.server_close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
@@ -0,0 +1,196 @@
+"""
+ssmx.aio mirrors the parameter-fetching helpers of ssmx as coroutines, for
+asyncio applications (Python 3.7+).
+
+SSM calls go through ssmx.call on a thread pool shared by every coroutine,
+so they reuse the process-wide client, its connection pool, the rate
+limiter and the retry budget. Batches and pages are awaited individually:
+the event loop stays free while they are in flight, and cancelling a
+coroutine (i.e. through asyncio.wait_for) stops it from waiting on them
+and from scheduling more.
+"""
+import asyncio
+import functools
+import threading
+
+import ssmx
+from ssmx import MAX_POOL_CONNECTIONS, MAX_WORKERS, SSMXError
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    get_executor returns the thread pool running SSM calls for every
+    coroutine, sized like the client's connection pool.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ssmx.thread_pool(MAX_POOL_CONNECTIONS)
+    return _executor
+
+
+async def run(func, *args, **kwargs):
+    """run awaits the blocking <func> on the shared thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+
+
+async def call(client, operation, **kwargs):
+    """call awaits the SSM <operation> through ssmx.call, rate limited and retried."""
+    return await run(ssmx.call, client, operation, **kwargs)
+
+
+async def paginate(client, operation, **kwargs):
+    """paginate lazily yields the pages of <operation>, fetching each one through call()."""
+    while True:
+        page = await call(client, operation, **kwargs)
+        ssmx.metrics.count(client, operation, 'pages')
+        yield page
+        if not page.get('NextToken'):
+            return
+        kwargs['NextToken'] = page['NextToken']
+
+
+async def with_timeout(coroutine, timeout):
+    """with_timeout awaits <coroutine>, raising asyncio.TimeoutError after <timeout> seconds."""
+    if timeout is None:
+        return await coroutine
+    return await asyncio.wait_for(coroutine, timeout)
+
+
+async def iter_params(names, profile=None, region=None, concurrency=MAX_WORKERS, invalid=None):
+    """
+    iter_params yields the parameters of <names> as their GetParameters
+    batches complete, with at most <concurrency> batches in flight, each
+    carrying the Selector it was requested with, if any.
+    Duplicate names are only fetched once. Invalid names are appended to
+    the <invalid> list when one is given.
+    """
+    client = await run(ssmx.get_client, profile, region)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(batch):
+        async with semaphore:
+            response = await call(client, 'get_parameters', Names=batch, WithDecryption=True)
+        for param in response.get('Parameters', []):
+            ssmx.selected_name(param, batch)
+        return response
+
+    tasks = [asyncio.ensure_future(fetch(batch)) for batch in ssmx.name_batches(ssmx.unique(names))]
+    try:
+        for future in asyncio.as_completed(tasks):
+            try:
+                response = await future
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                raise SSMXError("Error getting parameters: %s" % e)
+            if invalid is not None:
+                invalid.extend(response.get('InvalidParameters', []))
+            for param in response.get('Parameters', []):
+                yield param
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def get_params(names, profile=None, region=None, concurrency=MAX_WORKERS, timeout=None):
+    """
+    get_params retrieves <names>, which may carry a version or label selector,
+    in concurrent batches of 10 and returns the parameters and invalid names
+    in the order the names were given.
+    """
+    names = [name for name in ssmx.unique(names)]
+    invalid = []
+
+    async def collect():
+        params = {}
+        async for param in iter_params(names, profile, region, concurrency=concurrency, invalid=invalid):
+            params[ssmx.display_name(param)] = param
+        return params
+
+    params = await with_timeout(collect(), timeout)
+    output = [params.pop(name) for name in names if name in params]
+    # Names SSM reports under a different form (i.e. ARNs) go last
+    output.extend(params.values())
+    invalid = set(invalid)
+    return output, [name for name in names if name in invalid]
+
+
+async def iter_parameters_by_path(path, profile=None, region=None):
+    """iter_parameters_by_path yields every parameter under <path>, recursively, page by page."""
+    client = await run(ssmx.get_client, profile, region)
+    try:
+        async for page in paginate(client, 'get_parameters_by_path', Path=path, Recursive=True,
+                                   WithDecryption=True):
+            for param in page['Parameters']:
+                yield dict(Name=param.get('Name'), Value=param.get('Value'), Version=param.get('Version'))
+    except asyncio.CancelledError:
+        raise
+    except SSMXError:
+        raise
+    except Exception as e:
+        raise SSMXError("Error listing parameters: %s" % e)
+
+
+async def get_parameters_by_path(path, profile=None, region=None, timeout=None):
+    """get_parameters_by_path returns every parameter under <path>, recursively."""
+    async def collect():
+        return [param async for param in iter_parameters_by_path(path, profile, region)]
+
+    return await with_timeout(collect(), timeout)
+
+
+async def list_params(names, profile=None, region=None, limit=None, path=None, recursive=False, types=(),
+                      tiers=(), key_id=None, labels=(), fields=('Name', 'Description'), contains=()):
+    """
+    list_params lazily yields the <fields> of the parameters starting with
+    any of <names> and matching the filters of ssmx.list_query, one page at
+    a time. Paging stops as soon as <limit> parameters have been yielded.
+    """
+    if limit is not None and limit <= 0:
+        return
+    client = await run(ssmx.get_client, profile, region)
+    operation, kwargs = ssmx.list_query(names, path, recursive, types, tiers, key_id, labels, contains)
+    count = 0
+    try:
+        async for page in paginate(client, operation, **kwargs):
+            for param in page['Parameters']:
+                yield dict((field, param.get(field, '')) for field in fields)
+                count += 1
+                if limit is not None and count >= limit:
+                    return
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        raise SSMXError("Error listing parameters: %s" % e)
+
+
+async def resolve_env(env_file, names, profile=None, region=None, concurrency=MAX_WORKERS, timeout=None):
+    """
+    resolve_env builds the environment `ssmx exec` would from the ssm: refs
+    and plain values of <env_file>, then from the parameters under each of
+    <names>. The refs and every path are fetched concurrently.
+    See ssmx.build_env for what is returned.
+    """
+    env_vars = ssmx.parse_env_file(env_file) if env_file else []
+    paths = [n if n.startswith('/') else '/' + n for n in names]
+
+    async def resolve_refs():
+        secret_keys = [value[4:] for _, value in env_vars if value.startswith('ssm:')]
+        if not secret_keys:
+            return {}
+        output, invalid = await get_params(secret_keys, profile, region, concurrency=concurrency)
+        if invalid:
+            raise SSMXError("Error getting parameters: Invalid Parameters: %s" % ', '.join(invalid))
+        return dict((ssmx.display_name(param), param) for param in output)
+
+    async def resolve():
+        results = await asyncio.gather(resolve_refs(), *[get_parameters_by_path(path, profile, region)
+                                                         for path in paths])
+        return ssmx.build_env(env_vars, results[0], results[1:], warn=False)
+
+    return await with_timeout(resolve(), timeout)
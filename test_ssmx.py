@@ -0,0 +1,1217 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+
+import boto3
+import pytest
+import ssmx
+from botocore.exceptions import ClientError
+from click.testing import CliRunner
+from moto import mock_ssm
+
+
+@pytest.fixture(autouse=True)
+def fresh_clients(monkeypatch, tmp_path):
+    # Clients are cached process-wide; start every test from an empty registry
+    monkeypatch.setenv('SSMX_AGENT_SOCKET', str(tmp_path / 'no-agent.sock'))
+    monkeypatch.setenv('SSMX_CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(ssmx, 'metrics', ssmx.Metrics())
+    ssmx.clear_clients()
+    ssmx.rate_limiter.configure(ssmx.DEFAULT_MAX_TPS, ssmx.DEFAULT_RETRY_BUDGET)
+    ssmx.refresh()
+    yield
+    ssmx.clear_clients()
+
+
+@mock_ssm
+def test_client_registry_reuses_clients():
+    client = ssmx.get_client(None, 'us-east-1')
+
+    assert ssmx.get_client(None, 'us-east-1') is client
+    assert ssmx.get_client(None, 'eu-west-1') is not client
+    assert client.meta.config.max_pool_connections == ssmx.MAX_POOL_CONNECTIONS
+
+
+@mock_ssm
+def test_helpers_share_client():
+    conn = boto3.client('ssm')
+    conn.put_parameter(Name='test1', Value='value1', Type='SecureString')
+
+    ssmx.get_params(['test1'], None, None)
+    ssmx.get_param('test1', None, None)
+    [param for param in ssmx.list_params([], None, None)]
+
+    assert len(ssmx._clients) == 1
+
+
+def count_calls(client, operation):
+    calls = []
+    client.meta.events.register('provide-client-params.ssm.%s' % operation,
+                                lambda **kwargs: calls.append(kwargs['params']))
+    return calls
+
+
+@mock_ssm
+def test_fetch_params_batches_and_dedupes():
+    conn = boto3.client('ssm')
+    names = ['test%d' % i for i in range(25)]
+    for name in names:
+        conn.put_parameter(Name=name, Value='value-' + name, Type='SecureString')
+    calls = count_calls(ssmx.get_client(None, None), 'GetParameters')
+
+    params, invalid = ssmx.fetch_params(names + names[:5], None, None)
+
+    assert len(calls) == 3
+    assert all(len(call['Names']) <= 10 for call in calls)
+    assert invalid == []
+    assert params['test7']['Value'] == 'value-test7'
+
+
+@mock_ssm
+def test_cli_exec_reports_all_invalid_refs(tmp_path):
+    conn = boto3.client('ssm')
+    conn.put_parameter(Name='test1', Value='value1', Type='SecureString')
+    env_file = tmp_path / 'test.env'
+    env_file.write_text('A=ssm:test1\nB=ssm:missing1\nC=ssm:missing2\nD=plain\n')
+
+    runner = CliRunner()
+    result = runner.invoke(ssmx.execute, ['--env-file', str(env_file), '--', 'true'])
+
+    assert result.exit_code == 1
+    assert 'missing1' in result.output
+    assert 'missing2' in result.output
+
+
+@mock_ssm
+def test_get_params_more_than_ten_names_keeps_order():
+    conn = boto3.client('ssm')
+    names = ['test%02d' % i for i in range(23)]
+    for name in names:
+        conn.put_parameter(Name=name, Value='value-' + name, Type='SecureString')
+    requested = list(reversed(names)) + ['invalid']
+
+    out, err = ssmx.get_params(requested, None, None)
+
+    assert [param['Name'] for param in out] == requested[:-1]
+    assert err == ['invalid']
+
+
+@mock_ssm
+def test_cli_get_names_from_stdin():
+    conn = boto3.client('ssm')
+    for i in range(12):
+        conn.put_parameter(Name='test%d' % i, Value='value%d' % i, Type='SecureString')
+
+    runner = CliRunner()
+    names = '\n'.join('test%d' % i for i in range(12))
+    result = runner.invoke(ssmx.get, ['--names-from', '-'], input=names)
+
+    assert result.exit_code == 0
+    assert 'value11' in result.output
+    assert 'Invalid Parameters' not in result.output
+
+
+@mock_ssm
+def test_delete_params_more_than_ten_names():
+    conn = boto3.client('ssm')
+    names = ['test%d' % i for i in range(25)]
+    for name in names:
+        conn.put_parameter(Name=name, Value='value', Type='String')
+
+    out, err = ssmx.delete_params(names + ['invalid'], None, None)
+
+    assert sorted(out) == sorted(names)
+    assert err == ['invalid']
+    assert conn.describe_parameters()['Parameters'] == []
+
+
+@mock_ssm
+def test_cli_delete_path_dry_run():
+    conn = boto3.client('ssm')
+    for i in range(15):
+        conn.put_parameter(Name='/app/dev/key%d' % i, Value='value', Type='String')
+    conn.put_parameter(Name='/app/prod/key', Value='value', Type='String')
+
+    runner = CliRunner()
+    result = runner.invoke(ssmx.delete, ['--path', '/app/dev', '--dry-run'])
+
+    assert result.exit_code == 0
+    assert '/app/dev/key14' in result.output
+    assert '/app/prod/key' not in result.output
+    assert len(conn.get_parameters_by_path(Path='/app', Recursive=True)['Parameters']) == 10
+
+    result = runner.invoke(ssmx.delete, ['--path', 'app/dev'])
+
+    assert 'Deleted Parameters' in result.output
+    remaining = conn.get_parameters_by_path(Path='/app', Recursive=True)['Parameters']
+    assert [param['Name'] for param in remaining] == ['/app/prod/key']
+
+
+@mock_ssm
+def test_delete_params_reports_deletes_before_a_failed_batch(monkeypatch):
+    conn = boto3.client('ssm')
+    names = ['test%d' % i for i in range(15)]
+    for name in names:
+        conn.put_parameter(Name=name, Value='value', Type='String')
+    call = ssmx.call
+
+    def failing_call(client, op, **kwargs):
+        if op == 'delete_parameters' and 'test14' in kwargs['Names']:
+            raise Exception('ThrottlingException')
+        return call(client, op, **kwargs)
+    monkeypatch.setattr(ssmx, 'call', failing_call)
+
+    result = CliRunner().invoke(ssmx.delete, [arg for name in names for arg in ('--name', name)])
+
+    assert result.exit_code == 1
+    assert 'Deleted Parameters' in result.output
+    assert 'test9' in result.output
+    assert 'Error deleting parameters: ThrottlingException' in result.output
+    remaining = [param['Name'] for param in conn.describe_parameters()['Parameters']]
+    assert sorted(remaining) == sorted(names[10:])
+
+
+@mock_ssm
+def test_cli_delete_prefix():
+    conn = boto3.client('ssm')
+    conn.put_parameter(Name='preview-1.db', Value='value', Type='String')
+    conn.put_parameter(Name='preview-1.api', Value='value', Type='String')
+    conn.put_parameter(Name='preview-2.db', Value='value', Type='String')
+
+    runner = CliRunner()
+    result = runner.invoke(ssmx.delete, ['--prefix', 'preview-1.'])
+
+    assert 'preview-1.db' in result.output
+    assert 'preview-1.api' in result.output
+    names = [param['Name'] for param in conn.describe_parameters()['Parameters']]
+    assert names == ['preview-2.db']
+
+
+@mock_ssm
+def test_request_metadata_by_name_batches_filters():
+    conn = boto3.client('ssm')
+    names = ['/app/key%02d' % i for i in range(60)]
+    for name in names:
+        conn.put_parameter(Name=name, Value='value', Type='String')
+    client = ssmx.get_client(None, None)
+    describes = count_calls(client, 'DescribeParameters')
+
+    versions = ssmx.request_versions_by_name(client, names + ['/app/missing'])
+
+    assert versions == dict((name, 1) for name in names)
+    # moto may page each filter's results
+    assert sorted(set(len(call['ParameterFilters'][0]['Values']) for call in describes)) == [11, 50]
+
+
+@mock_ssm
+def test_cache_serves_and_revalidates(tmp_path):
+    conn = boto3.client('ssm')
+    conn.put_parameter(Name='test1', Value='value1', Type='SecureString')
+    client = ssmx.get_client(None, None)
+    gets = count_calls(client, 'GetParameters')
+    describes = count_calls(client, 'DescribeParameters')
+
+    cache = ssmx.ParamCache(60, None, None, directory=str(tmp_path))
+    params, _ = ssmx.fetch_params(['test1'], None, None, cache=cache)
+    assert params['test1']['Value'] == 'value1'
+    assert b'value1' not in open(cache.entry_path('name', 'test1'), 'rb').read()
+
+    # Fresh entries make no calls at all
+    params, _ = ssmx.fetch_params(['test1'], None, None, cache=cache)
+    assert params['test1']['Value'] == 'value1'
+    assert (len(gets), len(describes)) == (1, 0)
+
+    # Expired entries are revalidated by Version only
+    cache.ttl = 0
+    params, _ = ssmx.fetch_params(['test1'], None, None, cache=cache)
+    assert params['test1']['Value'] == 'value1'
+    assert (len(gets), len(describes)) == (1, 1)
+
+    # A new Version is refetched
+    conn.put_parameter(Name='test1', Value='value2', Type='SecureString', Overwrite=True)
+    params, _ = ssmx.fetch_params(['test1'], None, None, cache=cache)
+    assert params['test1']['Value'] == 'value2'
+    assert (len(gets), len(describes)) == (2, 2)
+
+
+@mock_ssm
+def test_cache_is_keyed_by_the_resolved_target(tmp_path, monkeypatch):
+    for region in ('us-east-1', 'eu-west-1'):
+        boto3.client('ssm', region_name=region).put_parameter(Name='test1', Value=region, Type='SecureString')
+
+    values = []
+    for region in ('us-east-1', 'eu-west-1'):
+        monkeypatch.setenv('AWS_DEFAULT_REGION', region)
+        ssmx.clear_clients()
+        cache = ssmx.ParamCache(0, None, None, directory=str(tmp_path))
+        params, _ = ssmx.fetch_params(['test1'], None, None, cache=cache)
+        values.append(params['test1']['Value'])
+
+    assert values == ['us-east-1', 'eu-west-1']
+
+
+@mock_ssm
+def test_cache_stale_if_error(tmp_path, monkeypatch):
+    conn = boto3.client('ssm')
+    conn.put_parameter(Name='/app/key', Value='value1', Type='SecureString')
+    cache = ssmx.ParamCache(0, None, None, directory=str(tmp_path))
+    ssmx.get_parameters_by_path('/app', None, None, cache=cache)
+
+    def unavailable(*args, **kwargs):
+        raise Exception('SSM is down')
+    monkeypatch.setattr(ssmx, 'request_versions', unavailable)
+
+    params = ssmx.get_parameters_by_path('/app', None, None, cache=cache)
+    assert [param['Value'] for param in params] == ['value1']
+
+    assert ssmx.clear_cache(str(tmp_path)) == 1
+
+
+@mock_ssm
+def test_cli_exec_multiple_names_last_wins(tmp_path):
+    conn = boto3.client('ssm')
+    conn.put_parameter(Name='/shared/log-level', Value='info', Type='String')
+    conn.put_parameter(Name='/shared/region', Value='us-east-1', Type='String')
+    conn.put_parameter(Name='/app/dev/log_level', Value='debug', Type='String')
+    out_file = tmp_path / 'env.out'
+
+    runner = CliRunner()
+    result = runner.invoke(ssmx.execute, ['--name', 'shared', '--name', '/app/dev', '--',
+                                          'sh', '-c', 'echo "$LOG_LEVEL $REGION" > %s' % out_file])
+
+    assert result.exit_code == 0
+    assert out_file.read_text().strip() == 'debug us-east-1'
+    assert 'LOG_LEVEL from /app/dev/log_level overrides /shared/log-level' in result.stderr
+
+
+@mock_ssm
+def test_list_params_is_lazy_and_limited():
+    conn = boto3.client('ssm')
+    for i in range(60):
+        conn.put_parameter(Name='test%02d' % i, Value='value', Type='String')
+    describes = count_calls(ssmx.get_client(None, None), 'DescribeParameters')
+
+    params = ssmx.list_params([], None, None, limit=15)
+    assert describes == []
+
+    assert len([param for param in params]) == 15
+    assert len(describes) == 2
+
+    assert [param for param in ssmx.list_params([], None, None, limit=0)] == []
+    assert len(describes) == 2
+    result = CliRunner().invoke(ssmx.list, ['--output', 'tsv', '--limit', '0'])
+    assert result.output == 'Name\tDescription\n'
+
+
+@mock_ssm
+def test_cli_list_output_formats():
+    conn = boto3.client('ssm')
+    conn.put_parameter(Name='test1', Value='value', Description='first', Type='String')
+    conn.put_parameter(Name='test2', Value='value', Type='String')
+
+    runner = CliRunner()
+    result = runner.invoke(ssmx.list, ['--output', 'jsonl'])
+    rows = [json.loads(line) for line in result.output.splitlines()]
+    assert rows == [{'Name': 'test1', 'Description': 'first'}, {'Name': 'test2', 'Description': ''}]
+
+    result = runner.invoke(ssmx.list, ['--output', 'json'])
+    assert json.loads(result.output) == rows
+
+    result = runner.invoke(ssmx.list, ['--output', 'tsv', '--limit', '1'])
+    assert result.output == 'Name\tDescription\ntest1\tfirst\n'
+
+    result = runner.invoke(ssmx.list, ['--output', 'json', '--name', 'missing'])
+    assert json.loads(result.output) == []
+
+
+def test_import_defers_heavy_modules():
+    code = ('import sys, ssmx; '
+            'print(",".join(m for m in ("boto3", "botocore", "tabulate", "concurrent.futures") if m in sys.modules))')
+    output = subprocess.check_output([sys.executable, '-c', code], universal_newlines=True,
+                                     cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert output.strip() == ''
+
+
+def test_cli_exec_propagates_exit_code():
+    runner = CliRunner()
+    result = runner.invoke(ssmx.execute, ['--', 'sh', '-c', 'exit 3'])
+
+    assert result.exit_code == 3
+
+
+def test_cli_exec_forwards_signals(tmp_path):
+    out_file = tmp_path / 'signal.out'
+    script = 'trap "echo TERM > %s; exit 0" TERM; kill -TERM $PPID; while :; do sleep 0.1; done' % out_file
+
+    runner = CliRunner()
+    result = runner.invoke(ssmx.execute, ['--', 'sh', '-c', script])
+
+    assert result.exit_code == 0
+    assert out_file.read_text().strip() == 'TERM'
+
+
+def test_cli_exec_replace_keeps_pid():
+    code = ('import os, sys, ssmx; sys.stderr.write("%d\\n" % os.getpid()); '
+            'ssmx.cli(["exec", "--replace", "--", "sh", "-c", "echo $$"])')
+    proc = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    assert proc.returncode == 0
+    assert proc.stdout.strip() == proc.stderr.strip()
+
+
+class ThrottledClient(object):
+    """Raises ThrottlingException for the first <throttles> calls."""
+
+    def __init__(self, throttles):
+        self.throttles = throttles
+        self.attempts = 0
+
+    def get_parameter(self, **kwargs):
+        self.attempts += 1
+        if self.attempts <= self.throttles:
+            raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}},
+                              'GetParameter')
+        return {'Parameter': {'Name': kwargs['Name'], 'Value': 'value'}}
+
+
+def test_call_retries_throttles_and_backs_off(monkeypatch):
+    monkeypatch.setattr(ssmx, 'RETRY_BASE_DELAY', 0.001)
+    monkeypatch.setattr(ssmx, 'RETRY_MAX_DELAY', 0.01)
+    ssmx.rate_limiter.configure(16.0, 10)
+    client = ThrottledClient(throttles=2)
+
+    response = ssmx.call(client, 'get_parameter', Name='test1')
+
+    assert response['Parameter']['Value'] == 'value'
+    assert client.attempts == 3
+    assert (ssmx.rate_limiter.throttled, ssmx.rate_limiter.retried) == (2, 2)
+    assert ssmx.rate_limiter.rate == 5.0
+
+
+def test_call_stops_when_retry_budget_is_spent(monkeypatch):
+    monkeypatch.setattr(ssmx, 'RETRY_BASE_DELAY', 0.001)
+    ssmx.rate_limiter.configure(16.0, 1)
+    client = ThrottledClient(throttles=5)
+
+    with pytest.raises(ClientError):
+        ssmx.call(client, 'get_parameter', Name='test1')
+    assert client.attempts == 2
+
+
+def test_cli_rejects_rates_below_the_minimum():
+    runner = CliRunner()
+    for args in (['--max-tps', '0'], ['--max-tps', '0.5'], ['--retry-budget', '-1']):
+        result = runner.invoke(ssmx.cli, args + ['get', '--name', 'test1'])
+        assert result.exit_code == 2
+        assert args[0] in result.output
+
+
+def test_rate_limiter_enforces_max_tps():
+    limiter = ssmx.RateLimiter(20.0, 0)
+    start = time.time()
+    for _ in range(30):
+        limiter.acquire()
+
+    # 20 calls burst through, the next 10 are paced at 20 per second
+    assert time.time() - start >= 0.45
+
+
+@mock_ssm
+def test_cli_put_from_file_writes_only_changes(tmp_path):
+    conn = boto3.client('ssm')
+    conn.put_parameter(Name='/app/same', Value='value', Type='String')
+    conn.put_parameter(Name='/app/changed', Value='old', Type='String')
+    params_file = tmp_path / 'params.json'
+    params_file.write_text(json.dumps([
+        {'name': '/app/same', 'value': 'value'},
+        {'name': '/app/changed', 'value': 'new'},
+        {'name': '/app/secret', 'value': 'shh', 'encrypt': True, 'description': 'a secret'},
+    ]))
+    puts = count_calls(ssmx.get_client(None, None), 'PutParameter')
+
+    runner = CliRunner()
+    result = runner.invoke(ssmx.put, ['--from-file', str(params_file)])
+
+    assert result.exit_code == 0
+    assert sorted(call['Name'] for call in puts) == ['/app/changed', '/app/secret']
+    assert conn.get_parameter(Name='/app/same')['Parameter']['Version'] == 1
+    assert conn.get_parameter(Name='/app/changed')['Parameter']['Value'] == 'new'
+    assert conn.get_parameter(Name='/app/secret')['Parameter']['Type'] == 'SecureString'
+    assert 'Created Parameters' in result.output
+    assert 'Updated Parameters' in result.output
+    assert 'Unchanged Parameters' in result.output
+
+
+@mock_ssm
+def test_cli_put_from_file_keeps_remote_types(tmp_path):
+    conn = boto3.client('ssm')
+    conn.put_parameter(Name='/app/token', Value='old', Type='SecureString', KeyId='alias/app', Description='token')
+    conn.put_parameter(Name='/app/same', Value='value', Type='SecureString', Description='same')
+    conn.put_parameter(Name='/app/plain', Value='old', Type='SecureString')
+    params_file = tmp_path / 'params.json'
+    params_file.write_text(json.dumps([
+        {'name': '/app/token', 'value': 'new'},
+        {'name': '/app/same', 'value': 'value'},
+        {'name': '/app/plain', 'value': 'old', 'type': 'String'},
+    ]))
+
+    runner = CliRunner()
+    result = runner.invoke(ssmx.put, ['--from-file', str(params_file)])
+
+    assert result.exit_code == 0
+    token = conn.describe_parameters(Filters=[{'Key': 'Name', 'Values': ['/app/token']}])['Parameters'][0]
+    assert (token['Type'], token['KeyId'], token['Description']) == ('SecureString', 'alias/app', 'token')
+    assert conn.get_parameter(Name='/app/token', WithDecryption=True)['Parameter']['Value'] == 'new'
+    # Nor does a missing description count as a change
+    assert conn.get_parameter(Name='/app/same')['Parameter']['Version'] == 1
+    # Only an explicit type changes it
+    assert conn.get_parameter(Name='/app/plain')['Parameter']['Type'] == 'String'
+
+    env_file = tmp_path / 'params.env'
+    env_file.write_text('/app/secret=shh\n')
+    result = runner.invoke(ssmx.put, ['--from-file', str(env_file), '--encrypt'])
+    assert result.exit_code == 0
+    assert conn.get_parameter(Name='/app/secret')['Parameter']['Type'] == 'SecureString'
+
+
+def test_load_entries_formats(tmp_path):
+    yaml_file = tmp_path / 'params.yaml'
+    yaml_file.write_text('/app/a: 1\n/app/b: two\n')
+    env_file = tmp_path / 'params.env'
+    env_file.write_text('A=1\nB=two\n')
+
+    assert [(e['Name'], e['Value']) for e in ssmx.load_entries(str(yaml_file))] == [('/app/a', '1'), ('/app/b', 'two')]
+    assert [(e['Name'], e['Value']) for e in ssmx.load_entries(str(env_file))] == [('A', '1'), ('B', 'two')]
+
+    json_file = tmp_path / 'params.json'
+    json_file.write_text(json.dumps({'/app/on': True, '/app/off': False, '/app/ratio': 0.5}))
+    assert [(e['Name'], e['Value']) for e in ssmx.load_entries(str(json_file))] == [
+        ('/app/off', 'false'), ('/app/on', 'true'), ('/app/ratio', '0.5')]
+    for value in (None, [1, 2], {'a': 1}):
+        json_file.write_text(json.dumps({'/app/bad': value}))
+        with pytest.raises(ssmx.SSMXError):
+            ssmx.load_entries(str(json_file))
+
+
+@mock_ssm
+def test_cli_sync_plan_and_apply(tmp_path):
+    conn = boto3.client('ssm')
+    conn.put_parameter(Name='/app/dev/same', Value='value', Type='String')
+    conn.put_parameter(Name='/app/dev/db/host', Value='old', Type='String')
+    conn.put_parameter(Name='/app/dev/stale', Value='value', Type='String')
+    tree = tmp_path / 'tree'
+    (tree / 'db').mkdir(parents=True)
+    (tree / 'same').write_text('value\n')
+    (tree / 'db' / 'host').write_text('new')
+    (tree / 'new').write_text('created')
+
+    runner = CliRunner()
+    result = runner.invoke(ssmx.sync, [str(tree), '--path', '/app/dev', '--plan', '--prune'])
+    assert result.exit_code == 0
+    assert 'create' in result.output and '/app/dev/new' in result.output
+    assert 'update' in result.output and '/app/dev/db/host' in result.output
+    assert 'delete' in result.output and '/app/dev/stale' in result.output
+    assert '/app/dev/same' not in result.output
+    assert conn.get_parameter(Name='/app/dev/db/host')['Parameter']['Value'] == 'old'
+
+    result = runner.invoke(ssmx.sync, [str(tree), '--path', '/app/dev'])
+    assert result.exit_code == 0
+    remote = dict((param['Name'], param['Value'])
+                  for param in conn.get_parameters_by_path(Path='/app/dev', Recursive=True)['Parameters'])
+    assert remote == {'/app/dev/same': 'value', '/app/dev/db/host': 'new',
+                      '/app/dev/new': 'created', '/app/dev/stale': 'value'}
+
+    result = runner.invoke(ssmx.sync, [str(tree), '--path', '/app/dev', '--prune'])
+    assert 'Deleted Parameters' in result.output
+    result = runner.invoke(ssmx.sync, [str(tree), '--path', '/app/dev', '--prune'])
+    assert 'Everything is in sync.' in result.output
+
+
+@mock_ssm
+def test_cli_sync_keeps_remote_types(tmp_path):
+    conn = boto3.client('ssm')
+    conn.put_parameter(Name='/app/token', Value='old', Type='SecureString', KeyId='alias/app', Description='token')
+    conn.put_parameter(Name='/app/same', Value='value', Type='SecureString')
+    tree = tmp_path / 'tree'
+    tree.mkdir()
+    (tree / 'token').write_text('new')
+    (tree / 'same').write_text('value')
+    (tree / 'new').write_text('created')
+
+    runner = CliRunner()
+    result = runner.invoke(ssmx.sync, [str(tree), '--path', '/app', '--plan'])
+    assert result.exit_code == 0
+    assert '/app/token' in result.output and '/app/same' not in result.output
+
+    result = runner.invoke(ssmx.sync, [str(tree), '--path', '/app'])
+    assert result.exit_code == 0
+    params = dict((param['Name'], param) for param in conn.describe_parameters()['Parameters'])
+    assert (params['/app/token']['Type'], params['/app/token']['KeyId']) == ('SecureString', 'alias/app')
+    assert params['/app/token']['Description'] == 'token'
+    assert params['/app/same']['Version'] == 1
+    assert params['/app/new']['Type'] == 'String'
+
+
+def test_cli_exec_from_snapshot(tmp_path, monkeypatch):
+    from cryptography.fernet import Fernet
+    monkeypatch.setenv('SSMX_CACHE_DIR', str(tmp_path / 'cache'))
+    snapshot = str(tmp_path / 'release.snapshot')
+    env_file = tmp_path / 'test.env'
+    env_file.write_text('PLAIN=hello\nSECRET=ssm:test1\n')
+    out_file = tmp_path / 'env.out'
+
+    with mock_ssm():
+        conn = boto3.client('ssm')
+        conn.put_parameter(Name='test1', Value='value1', Type='SecureString')
+        conn.put_parameter(Name='/app/db-host', Value='db.local', Type='String')
+        runner = CliRunner()
+        # A host-local key would make the snapshot unreadable anywhere else
+        result = runner.invoke(ssmx.export, ['--env-file', str(env_file), '--name', 'app', '--output', snapshot])
+        assert result.exit_code == 1
+        assert 'SSMX_CACHE_KEY' in result.stderr
+        assert not (tmp_path / 'cache').exists()
+
+        monkeypatch.setenv('SSMX_CACHE_KEY', Fernet.generate_key().decode('utf-8'))
+        result = runner.invoke(ssmx.export, ['--env-file', str(env_file), '--name', 'app', '--output', snapshot])
+        assert result.exit_code == 0
+        assert b'value1' not in open(snapshot, 'rb').read()
+
+        conn.put_parameter(Name='test1', Value='value2', Type='SecureString', Overwrite=True)
+        assert ssmx.verify_snapshot(ssmx.read_snapshot(snapshot)[1], None, None) == ['test1']
+
+    # Outside of the mock any SSM call would fail
+    ssmx.clear_clients()
+    result = runner.invoke(ssmx.execute, ['--from-snapshot', snapshot, '--',
+                                          'sh', '-c', 'echo "$PLAIN $SECRET $DB_HOST" > %s' % out_file])
+    assert result.exit_code == 0
+    assert out_file.read_text().strip() == 'hello value1 db.local'
+    assert ssmx._clients == {}
+
+    key_file = tmp_path / 'snapshot.key'
+    key_file.write_text(os.environ['SSMX_CACHE_KEY'])
+    monkeypatch.delenv('SSMX_CACHE_KEY')
+    result = runner.invoke(ssmx.execute, ['--from-snapshot', snapshot, '--', 'true'])
+    assert result.exit_code == 1
+    assert not (tmp_path / 'cache').exists()
+    result = runner.invoke(ssmx.execute, ['--from-snapshot', snapshot, '--key-file', str(key_file), '--', 'true'])
+    assert result.exit_code == 0
+
+
+@mock_ssm
+def test_env_watcher_refetches_only_changes(tmp_path):
+    conn = boto3.client('ssm')
+    conn.put_parameter(Name='test1', Value='value1', Type='SecureString')
+    conn.put_parameter(Name='/app/a', Value='a1', Type='String')
+    conn.put_parameter(Name='/app/b', Value='b1', Type='String')
+    env_file = tmp_path / 'test.env'
+    env_file.write_text('SECRET=ssm:test1\n')
+    watcher = ssmx.EnvWatcher(str(env_file), ('app',), None, None, 1, 0.2, 'restart', 'SIGHUP')
+    gets = count_calls(ssmx.get_client(None, None), 'GetParameters')
+
+    assert watcher.poll() is False
+    assert gets == []
+
+    conn.put_parameter(Name='/app/b', Value='b2', Type='String', Overwrite=True)
+    conn.put_parameter(Name='/app/c', Value='c1', Type='String')
+    assert watcher.poll() is True
+    assert sorted(gets[0]['Names']) == ['/app/b', '/app/c']
+    assert watcher.env()[0] == {'SECRET': 'value1', 'A': 'a1', 'B': 'b2', 'C': 'c1'}
+
+    conn.delete_parameter(Name='/app/a')
+    assert watcher.poll() is True
+    assert watcher.env()[0] == {'SECRET': 'value1', 'B': 'b2', 'C': 'c1'}
+
+
+@mock_ssm
+def test_env_watcher_follows_labels(tmp_path):
+    conn = boto3.client('ssm')
+    conn.put_parameter(Name='/app/x', Value='x1', Type='String')
+    conn.label_parameter_version(Name='/app/x', ParameterVersion=1, Labels=['prod'])
+    env_file = tmp_path / 'test.env'
+    env_file.write_text('LABELED=ssm:/app/x:prod\nPINNED=ssm:/app/x:1\n')
+    watcher = ssmx.EnvWatcher(str(env_file), (), None, None, 1, 0.2, 'restart', 'SIGHUP')
+    gets = count_calls(ssmx.get_client(None, None), 'GetParameters')
+
+    # The label is checked once, then only when /app/x gets a new version
+    assert watcher.poll() is False
+    assert watcher.poll() is False
+    assert [call['Names'] for call in gets] == [['/app/x:prod']]
+
+    conn.put_parameter(Name='/app/x', Value='x2', Type='String', Overwrite=True)
+    conn.label_parameter_version(Name='/app/x', ParameterVersion=2, Labels=['prod'])
+    assert watcher.poll() is True
+    assert watcher.env()[0] == {'LABELED': 'x2', 'PINNED': 'x1'}
+
+
+@mock_ssm
+def test_cli_exec_watch_restarts_on_change(tmp_path):
+    conn = boto3.client('ssm')
+    conn.put_parameter(Name='/app/x', Value='old', Type='String')
+    out_file = tmp_path / 'env.out'
+    script = 'echo "$X" >> %s; [ "$X" = new ] || sleep 5' % out_file
+
+    def change():
+        # Only once the command runs with the old value
+        while not (out_file.exists() and out_file.read_text()):
+            time.sleep(0.05)
+        conn.put_parameter(Name='/app/x', Value='new', Type='String', Overwrite=True)
+    timer = threading.Thread(target=change)
+    timer.start()
+
+    runner = CliRunner()
+    result = runner.invoke(ssmx.execute, ['--name', 'app', '--watch', '0.2', '--', 'sh', '-c', script])
+    timer.join()
+
+    assert result.exit_code == 0
+    assert out_file.read_text().split() == ['old', 'new']
+
+
+def test_cli_exec_watch_options_are_checked_before_spawning(tmp_path):
+    out_file = tmp_path / 'ran'
+    runner = CliRunner()
+
+    for args, error in ((['--watch-signal', 'NOPE'], 'unknown signal SIGNOPE'),
+                        (['--watch', '0'], "'--watch'"),
+                        (['--watch-jitter', '1'], "'--watch-jitter'")):
+        result = runner.invoke(ssmx.execute, ['--name', 'app', '--watch', '1', '--watch-action', 'signal'] + args +
+                               ['--', 'touch', str(out_file)])
+        assert result.exit_code == 2
+        assert error in result.output
+        assert not out_file.exists()
+
+    assert ssmx.signal_name('usr1') == 'SIGUSR1'
+    assert ssmx.signal_name('SIGHUP') == 'SIGHUP'
+
+
+@mock_ssm
+def test_cli_metrics_json(tmp_path):
+    conn = boto3.client('ssm')
+    for i in range(12):
+        conn.put_parameter(Name='/app/key%d' % i, Value='value%d' % i, Type='SecureString')
+    metrics_file = tmp_path / 'metrics.json'
+
+    runner = CliRunner()
+    names = '\n'.join('/app/key%d' % i for i in range(12))
+    result = runner.invoke(ssmx.cli, ['--metrics-json', str(metrics_file), '--timings',
+                                      'get', '--names-from', '-'], input=names)
+
+    assert result.exit_code == 0
+    document = json.loads(metrics_file.read_text())
+    stats = document['operations']['GetParameters']
+    assert stats['calls'] == 2
+    assert stats['errors'] == 0
+    assert stats['response_bytes'] > 0
+    assert sum(stats['latency_ms']['histogram'].values()) == 2
+    assert 'client_setup' in document['phases_s']
+    assert 'import' in document['phases_s']
+    assert 'GetParameters' in result.stderr
+
+
+def test_metrics_name_failed_connections_by_operation():
+    from botocore.config import Config
+    client = boto3.client('ssm', endpoint_url='http://127.0.0.1:9',
+                          config=Config(retries={'max_attempts': 0}, connect_timeout=1))
+    ssmx.metrics.enable(False, None)
+    ssmx.metrics.instrument(client)
+
+    with pytest.raises(Exception):
+        client.get_parameters(Names=['test1'])
+
+    stats = ssmx.metrics.summary()['operations']
+    assert [name for name in stats] == ['GetParameters']
+    assert (stats['GetParameters']['calls'], stats['GetParameters']['errors']) == (1, 1)
+
+
+@mock_ssm
+def test_metrics_count_pages():
+    conn = boto3.client('ssm')
+    for i in range(25):
+        conn.put_parameter(Name='/app/key%d' % i, Value='value', Type='String')
+    ssmx.metrics.enable(False, None)
+
+    assert len(ssmx.get_parameters_by_path('/app', None, None)) == 25
+
+    stats = ssmx.metrics.summary()['operations']['GetParametersByPath']
+    assert stats['pages'] == stats['calls'] == 3
+
+
+@mock_ssm
+def test_load_env_memoizes_until_refresh(tmp_path, monkeypatch):
+    conn = boto3.client('ssm')
+    conn.put_parameter(Name='/app/db-host', Value='db1', Type='String')
+    conn.put_parameter(Name='token', Value='secret', Type='SecureString')
+    env_file = tmp_path / 'test.env'
+    env_file.write_text('TOKEN=ssm:token\nPLAIN=yes\n')
+    monkeypatch.setenv('DB_HOST', 'unset')
+
+    env = ssmx.load_env(names=['app'], env_file=str(env_file))
+    assert env == {'TOKEN': 'secret', 'PLAIN': 'yes', 'DB_HOST': 'db1'}
+
+    conn.put_parameter(Name='/app/db-host', Value='db2', Type='String', Overwrite=True)
+    calls = count_calls(ssmx.get_client(None, None), 'GetParametersByPath')
+    assert ssmx.load_env(names=['app'], env_file=str(env_file))['DB_HOST'] == 'db1'
+    assert calls == []
+
+    ssmx.refresh()
+    env = ssmx.load_env(names=['app'], env_file=str(env_file), update_environ=True)
+    assert env['DB_HOST'] == 'db2'
+    assert os.environ['DB_HOST'] == 'db2'
+
+
+@mock_ssm
+def test_load_env_raises_on_invalid_refs(tmp_path):
+    env_file = tmp_path / 'test.env'
+    env_file.write_text('A=ssm:missing\n')
+
+    with pytest.raises(ssmx.SSMXError) as excinfo:
+        ssmx.load_env(env_file=str(env_file))
+    assert 'missing' in str(excinfo.value)
+
+
+@mock_ssm
+def test_aio_get_params_and_resolve_env(tmp_path):
+    import asyncio
+    from ssmx import aio
+
+    conn = boto3.client('ssm')
+    names = ['test%d' % i for i in range(25)]
+    for name in names:
+        conn.put_parameter(Name=name, Value='value-%s' % name, Type='SecureString')
+    for i in range(12):
+        conn.put_parameter(Name='/app/key%d' % i, Value='path%d' % i, Type='String')
+    env_file = tmp_path / 'test.env'
+    env_file.write_text('A=ssm:test3\nB=plain\n')
+
+    output, invalid = asyncio.run(aio.get_params(list(reversed(names)) + ['missing']))
+    assert [param['Name'] for param in output] == list(reversed(names))
+    assert invalid == ['missing']
+
+    env, sources = asyncio.run(aio.resolve_env(str(env_file), ['app'], timeout=30))
+    assert env['A'] == 'value-test3'
+    assert env['B'] == 'plain'
+    assert env['KEY11'] == 'path11'
+    assert sources['KEY0'] == {'Name': '/app/key0', 'Version': 1}
+
+
+@mock_ssm
+def test_aio_list_params_limit():
+    import asyncio
+    from ssmx import aio
+
+    conn = boto3.client('ssm')
+    for i in range(120):
+        conn.put_parameter(Name='/app/key%03d' % i, Value='value', Type='String')
+
+    async def collect(limit):
+        return [param async for param in aio.list_params(['/app'], limit=limit)]
+
+    assert len(asyncio.run(collect(60))) == 60
+    assert asyncio.run(collect(0)) == []
+
+
+@mock_ssm
+def test_agent_collapses_concurrent_fetches(tmp_path, monkeypatch):
+    from ssmx.agent import Agent
+
+    conn = boto3.client('ssm')
+    names = ['test%d' % i for i in range(10)]
+    for name in names:
+        conn.put_parameter(Name=name, Value='value-%s' % name, Type='SecureString')
+    for i in range(3):
+        conn.put_parameter(Name='/app/key%d' % i, Value='path%d' % i, Type='String')
+    socket_path = str(tmp_path / 'agent.sock')
+    monkeypatch.setenv('SSMX_AGENT_SOCKET', socket_path)
+    agent = Agent(socket_path, ttl=60).start()
+    try:
+        assert oct(os.stat(socket_path).st_mode & 0o777) == oct(0o600)
+        # Requests carry the region this process resolves, not the agent's
+        assert ssmx.caller_target(None, None) == (None, 'us-east-1')
+        gets = count_calls(ssmx.get_client(None, 'us-east-1'), 'GetParameters')
+        paths = count_calls(ssmx.get_client(None, 'us-east-1'), 'GetParametersByPath')
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(ssmx.fetch_params(names + ['missing'], None, None)))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(results) == 8
+        for params, invalid in results:
+            assert params['test3']['Value'] == 'value-test3'
+            assert invalid == ['missing']
+        assert len(gets) == 2
+        assert [p['Name'] for p in ssmx.get_parameters_by_path('/app', None, None)] == \
+            ['/app/key0', '/app/key1', '/app/key2']
+        ssmx.get_parameters_by_path('/app', None, None)
+        assert len(paths) == 1
+        assert ('name', None, 'us-east-1', 'test3') in agent.cache.entries
+
+        # The agent can't stand in for the default profile when it runs under another one
+        monkeypatch.setenv('AWS_PROFILE', 'agent-profile')
+        assert agent.handle(dict(op='names', names=['test3'], profile=None, region='us-east-1')) == dict(
+            unavailable='the agent runs under profile agent-profile')
+    finally:
+        agent.stop()
+    assert not os.path.exists(socket_path)
+
+
+def test_agent_request_gives_up_on_a_hung_agent(tmp_path, monkeypatch):
+    import socket
+    socket_path = str(tmp_path / 'hung.sock')
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(1)
+    monkeypatch.setenv('SSMX_AGENT_TIMEOUT', '0.2')
+    try:
+        started = time.time()
+        assert ssmx.agent_request(dict(op='names', names=['a'], profile=None, region='us-east-1'),
+                                  socket_path) is None
+        assert time.time() - started < 2
+    finally:
+        server.close()
+
+
+@mock_ssm
+def test_cli_list_filters_server_side():
+    conn = boto3.client('ssm')
+    for i in range(60):
+        conn.put_parameter(Name='/other/key%d' % i, Value='value', Type='String')
+    conn.put_parameter(Name='/app/db/host', Value='db', Type='String')
+    conn.put_parameter(Name='/app/db/password', Value='secret', Type='SecureString')
+    conn.put_parameter(Name='/app/name', Value='app', Type='String')
+    conn.label_parameter_version(Name='/app/db/host', ParameterVersion=1, Labels=['prod'])
+    calls = count_calls(ssmx.get_client(None, None), 'DescribeParameters')
+
+    runner = CliRunner()
+    result = runner.invoke(ssmx.list, ['--path', 'app', '--recursive', '--type', 'String',
+                                       '--fields', 'Name,Type,Version', '--output', 'jsonl'])
+
+    assert result.exit_code == 0
+    rows = [json.loads(line) for line in result.output.splitlines()]
+    assert rows == [{'Name': '/app/db/host', 'Type': 'String', 'Version': 1},
+                    {'Name': '/app/name', 'Type': 'String', 'Version': 1}]
+    assert len(calls) == 1
+    assert calls[0]['MaxResults'] == 50
+    assert {'Key': 'Path', 'Option': 'Recursive', 'Values': ['/app']} in calls[0]['ParameterFilters']
+
+    result = runner.invoke(ssmx.list, ['--path', '/app', '--output', 'tsv'])
+    assert result.output.splitlines()[1:] == ['/app/name\t']
+
+    result = runner.invoke(ssmx.list, ['--label', 'prod', '--output', 'jsonl', '--fields', 'Name'])
+    assert result.exit_code == 0
+    assert [json.loads(line) for line in result.output.splitlines()] == [{'Name': '/app/db/host'}]
+
+    result = runner.invoke(ssmx.list, ['--fields', 'Name,Value'])
+    assert result.exit_code == 2
+
+
+@mock_ssm
+def test_cli_get_fans_out_across_regions():
+    for region, value in (('us-east-1', 'one'), ('eu-west-1', 'one'), ('us-west-2', 'two')):
+        conn = boto3.client('ssm', region_name=region)
+        conn.put_parameter(Name='same', Value='everywhere', Type='String')
+        conn.put_parameter(Name='drifted', Value=value, Type='String')
+    regions = ['-r', 'us-east-1', '-r', 'eu-west-1', '-r', 'us-west-2']
+
+    runner = CliRunner()
+    result = runner.invoke(ssmx.get, ['-n', 'same', '-n', 'drifted'] + regions)
+    assert result.exit_code == 0
+    assert result.output.count('everywhere') == 3
+    assert 'default/eu-west-1' in result.output
+
+    result = runner.invoke(ssmx.get, ['-n', 'same', '-n', 'drifted', '--diff'] + regions)
+    assert result.exit_code == 0
+    assert 'everywhere' not in result.output
+    assert 'two' in result.output
+
+    result = runner.invoke(ssmx.list, ['--diff', '--fields', 'Name,Type', '-o', 'jsonl'] + regions)
+    assert result.exit_code == 0
+    assert result.output == ''
+
+
+@mock_ssm
+def test_cli_fan_out_reports_failed_targets(monkeypatch):
+    for region in ('us-east-1', 'eu-west-1'):
+        boto3.client('ssm', region_name=region).put_parameter(Name='token', Value=region, Type='String')
+    get_params, list_params = ssmx.get_params, ssmx.list_params
+
+    def denied(func):
+        def wrapper(names, profile, region, **kwargs):
+            if region == 'ap-south-1':
+                raise ssmx.SSMXError('AccessDeniedException')
+            return func(names, profile, region, **kwargs)
+        return wrapper
+    monkeypatch.setattr(ssmx, 'get_params', denied(get_params))
+    monkeypatch.setattr(ssmx, 'list_params', denied(list_params))
+    regions = ['-r', 'us-east-1', '-r', 'ap-south-1', '-r', 'eu-west-1']
+
+    runner = CliRunner()
+    for command, args in ((ssmx.get, ['-n', 'token']), (ssmx.get, ['-n', 'token', '--diff']),
+                          (ssmx.list, ['--fields', 'Name'])):
+        result = runner.invoke(command, args + regions)
+        assert result.exit_code == 1
+        assert 'default/eu-west-1' in result.stdout
+        assert 'default/ap-south-1' in result.stderr
+        assert 'AccessDeniedException' in result.stderr
+        assert '1 of 3 targets failed' in result.stderr
+
+
+def test_expand_targets_all_enabled_regions():
+    from moto import mock_ec2
+
+    with mock_ec2():
+        targets = ssmx.expand_targets((), ['all-enabled'])
+    assert (None, 'us-east-1') in targets
+    assert len(targets) > 10
+    assert ssmx.expand_targets(('a', 'b'), ('r1', 'r2', 'r1')) == [('a', 'r1'), ('a', 'r2'), ('b', 'r1'), ('b', 'r2')]
+
+
+@mock_ssm
+def test_cli_exec_falls_back_to_next_region(tmp_path):
+    boto3.client('ssm', region_name='eu-west-1').put_parameter(Name='token', Value='from-eu', Type='String')
+    env_file = tmp_path / 'test.env'
+    env_file.write_text('TOKEN=ssm:token\n')
+    out_file = tmp_path / 'env.out'
+
+    runner = CliRunner()
+    result = runner.invoke(ssmx.execute, ['--env-file', str(env_file), '-r', 'us-east-1', '-r', 'eu-west-1', '--',
+                                          'sh', '-c', 'echo "$TOKEN" > %s' % out_file])
+
+    assert result.exit_code == 0
+    assert out_file.read_text().strip() == 'from-eu'
+    assert 'default/us-east-1 failed' in result.stderr
+
+
+@mock_ssm
+def test_fallback_timeout_is_idle_time_and_stops_abandoned_calls():
+    boto3.client('ssm').put_parameter(Name='token', Value='value', Type='String')
+
+    def busy(profile, region):
+        # Longer than the timeout overall, but never idle that long
+        for _ in range(6):
+            ssmx.call(ssmx.get_client(profile, region), 'get_parameter', Name='token')
+            time.sleep(0.2)
+        return region
+
+    targets = [(None, 'us-east-1'), (None, 'eu-west-1')]
+    for target in targets:
+        ssmx.get_client(*target)
+    assert ssmx.resolve_with_fallback(targets, 0.6, busy) == (None, 'us-east-1', 'us-east-1')
+
+    calls = []
+    stopped = threading.Event()
+
+    def stalled(profile, region):
+        if region == 'us-east-1':
+            time.sleep(0.5)
+            try:
+                ssmx.call(ssmx.get_client(profile, region), 'get_parameter', Name='token')
+                calls.append(region)
+            finally:
+                stopped.set()
+        return region
+
+    assert ssmx.resolve_with_fallback(targets, 0.2, stalled) == (None, 'eu-west-1', 'eu-west-1')
+    assert stopped.wait(2)
+    assert calls == []
+
+
+@mock_ssm
+def test_walk_path_matches_serial_walk(tmp_path):
+    conn = boto3.client('ssm')
+    names = ['/app/%s/%s/key%d' % (team, env, i) for team in ('api', 'web', 'jobs') for env in ('dev', 'prod')
+             for i in range(15)] + ['/app/root%d' % i for i in range(7)] + ['/apple/not-under-app']
+    for name in names:
+        conn.put_parameter(Name=name, Value='value-%s' % name, Type='SecureString')
+    client = ssmx.get_client(None, None)
+    serial = []
+    for page in client.get_paginator('get_parameters_by_path').paginate(Path='/app', Recursive=True,
+                                                                       WithDecryption=True):
+        serial.extend(ssmx.path_record(param) for param in page['Parameters'])
+    hints_file = tmp_path / 'hints'
+    hints_file.write_text('/app/api\n/app/web/dev\n/app/web\n/elsewhere\n')
+    by_path = count_calls(client, 'GetParametersByPath')
+
+    def key(param):
+        return param['Name']
+
+    # Without hints only GetParametersByPath is needed
+    assert [param for param in ssmx.walk_path(client, '/app')] == serial
+    assert len(serial) == 97
+    assert len(by_path) == 10
+    walked = [param for param in ssmx.walk_path(client, '/app', ssmx.read_path_hints(str(hints_file)))]
+    assert sorted(walked, key=key) == sorted(serial, key=key)
+    assert len(walked) == len(serial)
+    assert set(call['Path'] for call in by_path[10:]) == {'/app', '/app/api', '/app/web'}
+
+    # A role without ssm:DescribeParameters falls back to paging the tree
+    def deny(**kwargs):
+        raise ClientError({'Error': {'Code': 'AccessDeniedException', 'Message': 'denied'}}, 'DescribeParameters')
+    client.meta.events.register('provide-client-params.ssm.DescribeParameters', deny)
+    walked = [param for param in ssmx.walk_path(client, '/app', ssmx.read_path_hints(str(hints_file)))]
+    assert sorted(walked, key=key) == sorted(serial, key=key)
+    assert len(walked) == len(serial)
+
+
+@mock_ssm
+def test_param_index_syncs_incrementally_and_answers_locally(monkeypatch):
+    conn = boto3.client('ssm')
+    for name in ('/app/db/host', '/app/db/password', '/app/name', '/other/app-key', 'plain'):
+        conn.put_parameter(Name=name, Value='value', Type='SecureString' if 'password' in name else 'String')
+    index = ssmx.ParamIndex(None, None)
+
+    assert index.sync() == (5, 0)
+    conn.put_parameter(Name='/app/name', Value='renamed', Type='String', Overwrite=True)
+    conn.delete_parameter(Name='plain')
+    assert index.sync() == (1, 1)
+
+    def names(**kwargs):
+        return [row['Name'] for row in index.query(**kwargs)]
+
+    assert names(names=['/app/d']) == ['/app/db/host', '/app/db/password']
+    assert names(contains=['app-']) == ['/other/app-key']
+    assert names(path='/app') == ['/app/name']
+    assert names(path='/app', recursive=True, types=['String']) == ['/app/db/host', '/app/name']
+    assert index.missing(['/app/name', 'plain']) == ['plain']
+
+    # Each resolved region has an index of its own
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'eu-west-1')
+    assert not ssmx.ParamIndex(None, None).exists()
+
+
+@mock_ssm
+def test_cli_list_local_and_exec_validation(tmp_path):
+    conn = boto3.client('ssm')
+    conn.put_parameter(Name='/app/db/host', Value='db', Type='String')
+    runner = CliRunner()
+
+    result = runner.invoke(ssmx.list, ['--refresh', '--name', '/app', '-o', 'jsonl', '--fields', 'Name,Version'])
+    assert result.exit_code == 0
+    assert json.loads(result.output) == {'Name': '/app/db/host', 'Version': 1}
+
+    conn.put_parameter(Name='/app/db/port', Value='5432', Type='String')
+    describes = count_calls(ssmx.get_client(None, None), 'DescribeParameters')
+    result = runner.invoke(ssmx.list, ['--local', '--contains', 'db/', '-o', 'tsv'])
+    assert result.output.splitlines() == ['Name\tDescription', '/app/db/host\t']
+    assert describes == []
+
+    env_file = tmp_path / 'test.env'
+    env_file.write_text('HOST=ssm:/app/db/host\nPORT=ssm:/app/db/port\nMISSING=ssm:/app/db/user\n')
+    gets = count_calls(ssmx.get_client(None, None), 'GetParameters')
+    result = runner.invoke(ssmx.execute, ['--env-file', str(env_file), '--', 'true'])
+    assert result.exit_code == 1
+    # The index only warns; GetParameters decides, and the index isn't synced on the way
+    assert 'Not in the local index, possibly misspelled: /app/db/port, /app/db/user' in result.stderr
+    assert 'Invalid Parameters: /app/db/user' in result.output
+    assert len(gets) == 1
+    assert describes == []
+
+    ctx = ssmx.execute.make_context('exec', ['--', 'true'])
+    assert ssmx.complete_paths(ctx, None, '/a') == ['/app/']
+    assert ssmx.complete_paths(ctx, None, '/app/') == ['/app/db/']
+    assert ssmx.complete_names(ctx, None, '/app/db/h') == ['/app/db/host']
+
+
+@mock_ssm
+def test_selectors_and_pinned_cache(tmp_path, monkeypatch):
+    conn = boto3.client('ssm')
+    for value in ('v1', 'v2', 'v3'):
+        conn.put_parameter(Name='/app/db', Value=value, Type='SecureString', Overwrite=True)
+    conn.label_parameter_version(Name='/app/db', ParameterVersion=2, Labels=['prod'])
+    gets = count_calls(ssmx.get_client(None, None), 'GetParameters')
+
+    params, invalid = ssmx.fetch_params(['/app/db:1', '/app/db:prod', '/app/db', '/app/db:9'], None, None)
+    assert dict((name, param['Value']) for name, param in params.items()) == {
+        '/app/db:1': 'v1', '/app/db:prod': 'v2', '/app/db': 'v3'}
+    assert invalid == ['/app/db:9']
+    # No batch asks for a parameter twice, so every answer matches one name
+    assert [call['Names'] for call in gets] == [['/app/db:1'], ['/app/db:prod'], ['/app/db'], ['/app/db:9']]
+
+    # Nothing is written to disk unless asked for
+    assert not (tmp_path / 'cache').exists()
+
+    # Exact versions come from the pinned cache from then on; labels can move
+    ssmx.fetch_params(['/app/db:1'], None, None, pinned=True)
+    params, _ = ssmx.fetch_params(['/app/db:1', '/app/db:prod'], None, None, pinned=True)
+    assert [call['Names'] for call in gets[5:]] == [['/app/db:prod']]
+    params, _ = ssmx.fetch_params(['/app/db:1'], None, None, pinned=True)
+    assert params['/app/db:1']['Value'] == 'v1'
+    assert len(gets) == 6
+
+    # Past max_bytes, the least recently used entries are evicted
+    cache = ssmx.PinnedCache(None, None, directory=str(tmp_path))
+    cache.store({'/app/db:1': dict(Name='/app/db', Value='v1', Version=1)})
+    cache.store({'/app/db:2': dict(Name='/app/db', Value='v2', Version=2)})
+    assert b'"v1"' not in open(cache.entry_path('/app/db:1'), 'rb').read()
+    os.utime(cache.entry_path('/app/db:1'), (1000, 1000))
+    os.utime(cache.entry_path('/app/db:2'), (2000, 2000))
+    assert cache.load('/app/db:1')['Value'] == 'v1'
+    cache.max_bytes = 2 * os.path.getsize(cache.entry_path('/app/db:1'))
+    cache.store({'/app/db:3': dict(Name='/app/db', Value='v3', Version=3)})
+    assert [cache.load(name) is not None for name in ('/app/db:1', '/app/db:2', '/app/db:3')] == [True, False, True]
+
+    # Entries of another resolved region are never shared
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'eu-west-1')
+    assert ssmx.PinnedCache(None, None, directory=str(tmp_path)).load('/app/db:1') is None
+
+    assert ssmx.split_selector('arn:aws:ssm:us-east-1:1:parameter/app/db:3') == (
+        'arn:aws:ssm:us-east-1:1:parameter/app/db', '3')
+    assert ssmx.split_selector('arn:aws:ssm:us-east-1:1:parameter/app/db') == (
+        'arn:aws:ssm:us-east-1:1:parameter/app/db', None)
+
+
+@mock_ssm
+def test_pinned_cache_unwritable_is_skipped(tmp_path, monkeypatch):
+    conn = boto3.client('ssm')
+    conn.put_parameter(Name='/app/db', Value='v1', Type='SecureString')
+    (tmp_path / 'file').write_text('')
+    monkeypatch.setenv('SSMX_CACHE_DIR', str(tmp_path / 'file' / 'cache'))
+    monkeypatch.setenv('SSMX_PINNED_CACHE', '1')
+
+    result = CliRunner().invoke(ssmx.get, ['--name', '/app/db:1'])
+
+    assert result.exit_code == 0
+    assert 'v1' in result.stdout
+    assert 'pinned cache is unavailable' in result.stderr
+
+
+@mock_ssm
+def test_cli_exec_pin_manifest(tmp_path):
+    conn = boto3.client('ssm')
+    conn.put_parameter(Name='/release/db_host', Value='db-1', Type='String')
+    conn.put_parameter(Name='/shared/token', Value='token-1', Type='SecureString')
+    env_file = tmp_path / 'test.env'
+    env_file.write_text('TOKEN=ssm:/shared/token\n')
+    manifest = tmp_path / 'release.pin'
+    out_file = tmp_path / 'env.out'
+    runner = CliRunner()
+
+    result = runner.invoke(ssmx.pin, ['--env-file', str(env_file), '--name', 'release', '-o', str(manifest)])
+    assert result.exit_code == 0
+    assert manifest.read_text() == '/release/db_host:1\n/shared/token:1\n'
+
+    conn.put_parameter(Name='/release/db_host', Value='db-2', Type='String', Overwrite=True)
+    conn.put_parameter(Name='/release/new_key', Value='new', Type='String')
+    client = ssmx.get_client(None, None)
+    gets = count_calls(client, 'GetParameters')
+    by_path = count_calls(client, 'GetParametersByPath')
+    args = ['--env-file', str(env_file), '--name', 'release', '--pin', str(manifest), '--',
+            'sh', '-c', 'echo "$DB_HOST $TOKEN ${NEW_KEY:-none}" > %s' % out_file]
+    for _ in range(2):
+        result = runner.invoke(ssmx.execute, args)
+        assert result.exit_code == 0
+        assert out_file.read_text().strip() == 'db-1 token-1 none'
+
+    # A repeat boot of the same release makes no value calls
+    assert len(gets) == 2
+    assert by_path == []